@@ -3,6 +3,7 @@ from logging.config import fileConfig
 from sqlalchemy import create_engine
 
 from alembic import context  # type: ignore[attr-defined]
+from birthday.partitions import is_partition_name
 from birthday.utils import get_database_url
 
 # this is the Alembic Config object, which provides
@@ -29,6 +30,13 @@ target_metadata = metadata
 url = get_database_url()
 
 
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    # Monthly partitions are managed by the bot, not by the models
+    if type_ == "table" and reflected and compare_to is None:
+        return not any(is_partition_name(table, name) for table in metadata.tables)
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -47,6 +55,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -68,7 +77,11 @@ def run_migrations_online() -> None:
     connectable = create_engine(url)
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
@@ -0,0 +1,83 @@
+"""Add Profile guild_id, user_id unique constraint
+
+Revision ID: 96ddf81d3cb3
+Revises: d3e23dcfde20
+Create Date: 2026-10-18 09:10:42.518204+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "96ddf81d3cb3"
+down_revision = "d3e23dcfde20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Racing get_or_create calls could create duplicate profiles, merge them into
+    # the oldest one before adding the constraint
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE profile_duplicate ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, min(id) OVER (PARTITION BY guild_id, user_id) AS keep_id
+            FROM profile
+        ) AS profiles
+        WHERE id <> keep_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE profile SET points = profile.points + merged.points
+        FROM (
+            SELECT keep_id, sum(points) AS points
+            FROM profile JOIN profile_duplicate USING (id)
+            GROUP BY keep_id
+        ) AS merged
+        WHERE profile.id = merged.keep_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE "transaction" SET profile = profile_duplicate.keep_id
+        FROM profile_duplicate WHERE "transaction".profile = profile_duplicate.id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO map_segment (profile, number)
+        SELECT keep_id, number
+        FROM map_segment JOIN profile_duplicate ON map_segment.profile = profile_duplicate.id
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO map_completion (profile, completed_at)
+        SELECT keep_id, completed_at
+        FROM map_completion
+        JOIN profile_duplicate ON map_completion.profile = profile_duplicate.id
+        ON CONFLICT DO NOTHING
+        """
+    )
+    for table in ("map_segment", "map_completion"):
+        op.execute(
+            f"""
+            DELETE FROM {table} USING profile_duplicate
+            WHERE {table}.profile = profile_duplicate.id
+            """
+        )
+    op.execute(
+        "DELETE FROM profile USING profile_duplicate WHERE profile.id = profile_duplicate.id"
+    )
+
+    op.create_unique_constraint(
+        "uc_profile_guild_id_user_id", "profile", ["guild_id", "user_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint("uc_profile_guild_id_user_id", "profile", type_="unique")
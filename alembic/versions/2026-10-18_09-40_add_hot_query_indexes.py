@@ -0,0 +1,33 @@
+"""Add indexes for hot queries
+
+Revision ID: bd9247ef1f43
+Revises: 96ddf81d3cb3
+Create Date: 2026-10-18 09:40:17.204811+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "bd9247ef1f43"
+down_revision = "96ddf81d3cb3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Profile lookups by (guild_id, user_id) use uc_profile_guild_id_user_id
+    op.create_index("ix_profile_guild_id_points", "profile", ["guild_id", "points"])
+    op.create_index(
+        "ix_transaction_profile_timestamp", "transaction", ["profile", "timestamp"]
+    )
+    op.create_index(
+        "ix_map_completion_completed_at", "map_completion", ["completed_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_map_completion_completed_at", "map_completion")
+    op.drop_index("ix_transaction_profile_timestamp", "transaction")
+    op.drop_index("ix_profile_guild_id_points", "profile")
@@ -0,0 +1,58 @@
+"""Store map segments as a Profile bitmask
+
+Revision ID: 0b3848f0d71c
+Revises: bd9247ef1f43
+Create Date: 2026-10-18 10:15:03.881652+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0b3848f0d71c"
+down_revision = "bd9247ef1f43"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "profile",
+        sa.Column("map_segments", sa.Integer(), server_default="0", nullable=False),
+    )
+    # Segment N is stored as bit N - 1
+    op.execute(
+        """
+        UPDATE profile SET map_segments = segments.bitmask
+        FROM (
+            SELECT profile, bit_or(1 << (number - 1)) AS bitmask
+            FROM map_segment GROUP BY profile
+        ) AS segments
+        WHERE profile.id = segments.profile
+        """
+    )
+    op.drop_table("map_segment")
+
+
+def downgrade() -> None:
+    op.create_table(
+        "map_segment",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("profile", sa.Integer(), nullable=False),
+        sa.Column("number", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["profile"], ["profile.id"], name="fk_map_segment_profile_id_profile"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("profile", "number", name="uc_map_segment_profile_number"),
+    )
+    op.execute(
+        """
+        INSERT INTO map_segment (profile, number)
+        SELECT profile.id, number
+        FROM profile, generate_series(1, 30) AS number
+        WHERE profile.map_segments & (1 << (number - 1)) <> 0
+        """
+    )
+    op.drop_column("profile", "map_segments")
@@ -0,0 +1,34 @@
+"""Add map segment ranking index
+
+Revision ID: 5e1c7a92d4b0
+Revises: 0b3848f0d71c
+Create Date: 2026-10-18 10:50:26.417093+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e1c7a92d4b0"
+down_revision = "0b3848f0d71c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Matches the ORDER BY of the map segment ranking, so pages are read in order
+    op.create_index(
+        "ix_profile_guild_id_map_segment_count",
+        "profile",
+        [
+            "guild_id",
+            sa.text("bit_count(map_segments::bit(32)) DESC"),
+            "user_id",
+        ],
+        postgresql_where=sa.text("map_segments <> 0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_profile_guild_id_map_segment_count", "profile")
@@ -0,0 +1,35 @@
+"""Add Transaction history covering index
+
+Revision ID: a41f6d0c93e7
+Revises: 5e1c7a92d4b0
+Create Date: 2026-10-18 11:30:48.052716+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a41f6d0c93e7"
+down_revision = "5e1c7a92d4b0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # History pages are read backwards in (timestamp, id) order of a single profile,
+    # the included columns let them be served by index-only scans
+    op.create_index(
+        "ix_transaction_profile_timestamp_id",
+        "transaction",
+        ["profile", "timestamp", "id"],
+        postgresql_include=["amount", "reason"],
+    )
+    op.drop_index("ix_transaction_profile_timestamp", "transaction")
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_transaction_profile_timestamp", "transaction", ["profile", "timestamp"]
+    )
+    op.drop_index("ix_transaction_profile_timestamp_id", "transaction")
@@ -0,0 +1,138 @@
+"""Partition Transaction by month
+
+Revision ID: 7c2e5b9d1f38
+Revises: a41f6d0c93e7
+Create Date: 2026-10-18 12:10:21.417302+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7c2e5b9d1f38"
+down_revision = "a41f6d0c93e7"
+branch_labels = None
+depends_on = None
+
+# Partitions are created for every month with transactions and the next 3 months,
+# later ones are created by the partition maintenance task of the bot
+CREATE_PARTITIONS = """
+DO $$
+DECLARE
+    month date;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', least(
+                (SELECT min(timestamp) FROM transaction_unpartitioned),
+                now() AT TIME ZONE 'utc'
+            )),
+            date_trunc('month', now() AT TIME ZONE 'utc') + interval '3 months',
+            interval '1 month'
+        )
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF "transaction" FOR VALUES FROM (%L) TO (%L)',
+            'transaction_' || to_char(month, 'YYYY_MM'),
+            month,
+            month + interval '1 month'
+        );
+    END LOOP;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    op.execute(
+        "ALTER TABLE transaction_unpartitioned "
+        "RENAME CONSTRAINT transaction_pkey TO transaction_unpartitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE transaction_unpartitioned DROP CONSTRAINT "
+        "fk_transaction_profile_id_profile"
+    )
+    op.drop_index("ix_transaction_profile_timestamp_id", "transaction_unpartitioned")
+
+    # The partition key has to be a part of the primary key
+    op.create_table(
+        "transaction",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('transaction_id_seq')"),
+            nullable=False,
+        ),
+        sa.Column("profile", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("reason", sa.String(length=255), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["profile"], ["profile.id"], name="fk_transaction_profile_id_profile"
+        ),
+        sa.PrimaryKeyConstraint("id", "timestamp", name="transaction_pkey"),
+        postgresql_partition_by="RANGE (timestamp)",
+    )
+    op.execute(CREATE_PARTITIONS)
+    op.execute(
+        'INSERT INTO "transaction" (id, profile, amount, reason, timestamp) '
+        "SELECT id, profile, amount, reason, "
+        "coalesce(timestamp, now() AT TIME ZONE 'utc') "
+        "FROM transaction_unpartitioned"
+    )
+    # Created on every partition, including the future ones
+    op.create_index(
+        "ix_transaction_profile_timestamp_id",
+        "transaction",
+        ["profile", "timestamp", "id"],
+        postgresql_include=["amount", "reason"],
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.drop_table("transaction_unpartitioned")
+
+
+def downgrade() -> None:
+    # Transactions of archived partitions are not moved back, dropping the
+    # partitioned table drops its attached partitions
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_partitioned')
+    op.execute(
+        "ALTER TABLE transaction_partitioned "
+        "RENAME CONSTRAINT transaction_pkey TO transaction_partitioned_pkey"
+    )
+    op.execute(
+        "ALTER TABLE transaction_partitioned DROP CONSTRAINT "
+        "fk_transaction_profile_id_profile"
+    )
+    op.drop_index("ix_transaction_profile_timestamp_id", "transaction_partitioned")
+
+    op.create_table(
+        "transaction",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('transaction_id_seq')"),
+            nullable=False,
+        ),
+        sa.Column("profile", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.Integer(), nullable=False),
+        sa.Column("reason", sa.String(length=255), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["profile"], ["profile.id"], name="fk_transaction_profile_id_profile"
+        ),
+        sa.PrimaryKeyConstraint("id", name="transaction_pkey"),
+    )
+    op.execute(
+        'INSERT INTO "transaction" (id, profile, amount, reason, timestamp) '
+        "SELECT id, profile, amount, reason, timestamp FROM transaction_partitioned"
+    )
+    op.create_index(
+        "ix_transaction_profile_timestamp_id",
+        "transaction",
+        ["profile", "timestamp", "id"],
+        postgresql_include=["amount", "reason"],
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.drop_table("transaction_partitioned")
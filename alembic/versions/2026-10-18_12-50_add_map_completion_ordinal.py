@@ -0,0 +1,65 @@
+"""Add MapCompletion ordinal
+
+Revision ID: d93a4c6e2b17
+Revises: 7c2e5b9d1f38
+Create Date: 2026-10-18 12:50:37.604118+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d93a4c6e2b17"
+down_revision = "7c2e5b9d1f38"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "map_completion_counter",
+        sa.Column("guild_id", sa.BigInteger(), autoincrement=False, nullable=False),
+        sa.Column("completions", sa.Integer(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("guild_id"),
+    )
+    op.add_column("map_completion", sa.Column("guild_id", sa.BigInteger()))
+    op.add_column("map_completion", sa.Column("ordinal", sa.Integer()))
+
+    # Number the existing completions in the order the ranking used to show them
+    op.execute(
+        """
+        UPDATE map_completion SET guild_id = numbered.guild_id, ordinal = numbered.ordinal
+        FROM (
+            SELECT map_completion.id, profile.guild_id, row_number() OVER (
+                PARTITION BY profile.guild_id
+                ORDER BY map_completion.completed_at, map_completion.id
+            ) AS ordinal
+            FROM map_completion JOIN profile ON profile.id = map_completion.profile
+        ) AS numbered
+        WHERE map_completion.id = numbered.id
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO map_completion_counter (guild_id, completions)
+        SELECT guild_id, max(ordinal) FROM map_completion GROUP BY guild_id
+        """
+    )
+
+    op.alter_column("map_completion", "guild_id", nullable=False)
+    op.alter_column("map_completion", "ordinal", nullable=False)
+    op.create_unique_constraint(
+        "uc_map_completion_guild_id_ordinal", "map_completion", ["guild_id", "ordinal"]
+    )
+    op.drop_index("ix_map_completion_completed_at", "map_completion")
+
+
+def downgrade() -> None:
+    op.create_index(
+        "ix_map_completion_completed_at", "map_completion", ["completed_at"]
+    )
+    op.drop_constraint("uc_map_completion_guild_id_ordinal", "map_completion")
+    op.drop_column("map_completion", "ordinal")
+    op.drop_column("map_completion", "guild_id")
+    op.drop_table("map_completion_counter")
@@ -0,0 +1,129 @@
+"""
+Benchmarks for the hot queries, through `databases` and through the repository
+
+Runs every hot query of the repository against an existing profile, and the
+same query as text through `databases`, which compiles it with SQLAlchemy on
+every call. The balance change adds 0 points, so nothing changes:
+
+    alembic upgrade head
+    python -m benchmarks.hot_queries --iterations 2000
+
+Every case reports p50/p99 latency and the CPU time of a call.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Awaitable, Callable
+
+from birthday.metrics import InstrumentedDatabase
+from birthday.pool import get_pool_options
+from birthday.repository import Repository
+from birthday.utils import get_database_url
+
+DATABASES_QUERIES: dict[str, str] = {
+    "profile lookup": """
+        SELECT id, user_id, guild_id, points, map_segments
+        FROM profile WHERE user_id = :user_id AND guild_id = :guild_id
+    """,
+    "balance change": """
+        UPDATE profile SET points = points + :amount
+        WHERE id = :profile_id RETURNING points
+    """,
+    "map segment ranking": """
+        SELECT user_id, bit_count(map_segments::bit(32)) AS segments
+        FROM profile
+        WHERE guild_id = :guild_id AND map_segments <> 0
+        ORDER BY bit_count(map_segments::bit(32)) DESC, user_id
+        LIMIT :limit OFFSET :offset
+    """,
+    "map completion ranking": """
+        SELECT map_completion.ordinal, profile.user_id, map_completion.completed_at
+        FROM map_completion JOIN profile ON profile.id = map_completion.profile
+        WHERE map_completion.guild_id = :guild_id
+        ORDER BY map_completion.ordinal
+        LIMIT :limit OFFSET :offset
+    """,
+}
+
+
+def percentile(samples: list[float], q: int) -> float:
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+async def bench(name: str, func: Callable[[], Awaitable[Any]], iterations: int) -> None:
+    # Warm up the connections and their statement caches
+    for _ in range(min(iterations, 50)):
+        await func()
+
+    samples = []
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    cpu_time = (time.process_time() - cpu_start) / iterations
+
+    print(
+        f"{name:<40} p50 {percentile(samples, 50) * 1000:7.3f}ms"
+        f"  p99 {percentile(samples, 99) * 1000:7.3f}ms"
+        f"  cpu {cpu_time * 1_000_000:7.1f}us"
+    )
+
+
+async def run(iterations: int) -> None:
+    database = InstrumentedDatabase(get_database_url(), **get_pool_options())
+    async with database:
+        repository = Repository(database, database)
+        profile = await database.fetch_one(
+            "SELECT id, user_id, guild_id FROM profile ORDER BY id LIMIT 1"
+        )
+        if profile is None:
+            raise SystemExit("The database has no profiles to query")
+
+        values = {
+            "user_id": profile["user_id"],
+            "guild_id": profile["guild_id"],
+            "profile_id": profile["id"],
+            "amount": 0,
+            "limit": 10,
+            "offset": 0,
+        }
+        cases: dict[str, Callable[[], Awaitable[Any]]] = {
+            "profile lookup": lambda: repository.get_profile(
+                profile["user_id"], profile["guild_id"]
+            ),
+            "balance change": lambda: repository.add_points(profile["id"], 0, None),
+            "map segment ranking": lambda: repository.get_map_segment_ranking(
+                profile["guild_id"], None, 0, 10
+            ),
+            "map completion ranking": lambda: repository.get_map_completion_ranking(
+                profile["guild_id"], None, 0, 10
+            ),
+        }
+
+        for name, query in DATABASES_QUERIES.items():
+            query_values = {k: v for k, v in values.items() if f":{k}" in query}
+            await bench(
+                f"{name} (databases)",
+                lambda: database.fetch_all(query, query_values),
+                iterations,
+            )
+            await bench(f"{name} (repository)", cases[name], iterations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Benchmarks for the map rendering pipeline
+
+Run with the same environment as the bot:
+
+    python -m benchmarks.map_rendering --output baseline.json
+    python -m benchmarks.map_rendering --compare baseline.json
+
+Every case reports throughput, p50/p99 latency and peak RSS. With `--compare`
+the run exits with status 1 if any case got slower than the baseline by more
+than `--tolerance`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable
+
+from birthday.cache import TTLCache
+from birthday.extensions.map.cache import MapImageCache
+from birthday.extensions.map.encoder import EncoderMode, MapEncoder
+from birthday.extensions.map.map_image import MapImageGenerator
+from birthday.extensions.map.renderer import MapRenderer
+from birthday.extensions.map.utils import get_segments_bitmask
+from birthday.extensions.map.views import MapImageView
+
+SEGMENT_COUNTS = [0, 1, 5, 10, 15, 20, 25, 29, 30]
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+@dataclass
+class Result:
+    name: str
+    iterations: int
+    throughput: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_kb: int
+
+
+def peak_rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def percentile(samples: list[float], q: int) -> float:
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def summarize(name: str, samples: list[float], elapsed: float) -> Result:
+    return Result(
+        name=name,
+        iterations=len(samples),
+        throughput=len(samples) / elapsed,
+        p50_ms=percentile(samples, 50) * 1000,
+        p99_ms=percentile(samples, 99) * 1000,
+        peak_rss_kb=peak_rss_kb(),
+    )
+
+
+def bench(name: str, func: Callable[[], object], iterations: int) -> Result:
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - call_start)
+
+    return summarize(name, samples, time.perf_counter() - start)
+
+
+async def bench_async(
+    name: str,
+    func: Callable[[], Awaitable[object]],
+    iterations: int,
+    concurrency: int = 1,
+) -> Result:
+    samples = []
+
+    async def timed() -> None:
+        call_start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - call_start)
+
+    start = time.perf_counter()
+    for _ in range(max(1, iterations // concurrency)):
+        await asyncio.gather(*[timed() for _ in range(concurrency)])
+
+    return summarize(name, samples, time.perf_counter() - start)
+
+
+def segments(count: int) -> list[int]:
+    return list(range(1, count + 1))
+
+
+async def run(iterations: int, workers: int) -> list[Result]:
+    results = [
+        bench("startup/jpeg", lambda: MapImageGenerator(use_pack=False), iterations),
+        bench("startup/pack", MapImageGenerator, iterations),
+    ]
+    generator = MapImageGenerator()
+
+    for count in SEGMENT_COUNTS:
+        results.append(
+            bench(
+                f"compose/{count}",
+                lambda: generator.get_image(segments(count)),
+                iterations,
+            )
+        )
+
+    full_map = generator.get_image(segments(MapImageGenerator.SEGMENTS))
+    for mode in EncoderMode:
+        encoder = MapEncoder(mode=mode, target_size=256 * 1024)
+        results.append(
+            bench(f"encode/{mode.value}", lambda: encoder.encode(full_map), iterations)
+        )
+
+    with ThreadPoolExecutor(workers) as executor:
+        cache = MapImageCache(CACHE_SIZE)
+        renderer = MapRenderer(generator, MapEncoder(), cache, executor)
+
+        for count in SEGMENT_COUNTS:
+
+            async def render_cold() -> None:
+                cache.clear()
+                await renderer.render(get_segments_bitmask(segments(count)))
+
+            results.append(
+                await bench_async(f"render/cold/{count}", render_cold, iterations)
+            )
+            results.append(
+                await bench_async(
+                    f"render/warm/{count}",
+                    lambda: renderer.render(get_segments_bitmask(segments(count))),
+                    iterations,
+                )
+            )
+
+        for concurrency in (1, workers, workers * 4):
+            states = iter(range(sys.maxsize))
+
+            async def render_distinct() -> None:
+                # Distinct states, so every render misses the cache
+                cache.clear()
+                state = next(states) % (1 << MapImageGenerator.SEGMENTS)
+                await renderer.render(state)
+
+            results.append(
+                await bench_async(
+                    f"render/concurrent/{concurrency}",
+                    render_distinct,
+                    iterations,
+                    concurrency,
+                )
+            )
+
+        async def view_get_map() -> None:
+            cache.clear()
+            view = MapImageView(
+                None,  # type: ignore[arg-type]
+                "Benchmark",
+                None,  # type: ignore[arg-type]
+                get_segments_bitmask(segments(MapImageGenerator.SEGMENTS)),
+                renderer,
+                TTLCache(ttl=0, max_entries=1),
+            )
+            await view.get_map()
+
+        results.append(await bench_async("view/get_map", view_get_map, iterations))
+
+    return results
+
+
+def compare(results: list[Result], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as file:
+        baseline = {case["name"]: case for case in json.load(file)["results"]}
+
+    ok = True
+    for result in results:
+        if (previous := baseline.get(result.name)) is None:
+            continue
+
+        # Cached cases take microseconds, ignore noise below 0.1ms
+        limit = max(previous["p50_ms"] * (1 + tolerance), previous["p50_ms"] + 0.1)
+        if result.p50_ms > limit:
+            ok = False
+            print(
+                f"REGRESSION {result.name}: p50 {result.p50_ms:.2f}ms, "
+                f"baseline {previous['p50_ms']:.2f}ms"
+            )
+
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="Save the results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare the results with a JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.iterations, args.workers))
+
+    print(f"{'case':<28}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS MiB':>10}")
+    for result in results:
+        print(
+            f"{result.name:<28}{result.throughput:>10.1f}{result.p50_ms:>10.3f}"
+            f"{result.p99_ms:>10.3f}{result.peak_rss_kb / 1024:>10.1f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "iterations": args.iterations,
+                    "workers": args.workers,
+                    "results": [asdict(result) for result in results],
+                },
+                file,
+                indent=2,
+            )
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
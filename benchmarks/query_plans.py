@@ -0,0 +1,224 @@
+"""
+Query plan regression checks for the hot queries
+
+Seeds the database with a realistic amount of data, runs `EXPLAIN` on the hot
+statements of the repository and the models, and fails if any of them uses a
+sequential scan. Partitions with less than `SMALL_PARTITION_ROWS` rows, like
+old months, are cheaper to scan than to look up and don't count. Everything
+runs in a transaction which is rolled back at the end, but the schema must be
+migrated:
+
+    alembic upgrade head
+    python -m benchmarks.query_plans
+
+`tests.test_query_plans` runs the same checks with fewer transactions whenever the
+test suite can reach the database.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Any, Iterator
+
+import databases
+
+from birthday.constants import MAP_ELEMENT_COST
+from birthday.extensions.map.map_image import MapImageGenerator
+from birthday.models import (
+    LEADERBOARD_QUERY,
+    TRANSACTION_COUNT_QUERY,
+    TRANSACTION_HISTORY_AFTER_CONDITION,
+    TRANSACTION_HISTORY_QUERY,
+)
+from birthday.repository import (
+    ADD_POINTS_QUERY,
+    BUY_RANDOM_MAP_SEGMENTS_QUERY,
+    MAP_COMPLETION_RANKING_QUERY,
+    MAP_SEGMENT_RANKING_AFTER_QUERY,
+    MAP_SEGMENT_RANKING_QUERY,
+    PROFILE_QUERY,
+)
+from birthday.utils import get_database_url
+
+# Seeded profiles use negative guild IDs, so they never clash with real ones
+GUILD_ID = -1
+
+SMALL_PARTITION_ROWS = 1000
+
+SEED_QUERIES = [
+    """
+    INSERT INTO profile (user_id, guild_id, points, map_segments)
+    SELECT i, -(i % :guilds + 1), (i * 7919) % 10000, (i::bigint * 104729) % (1 << 30)
+    FROM generate_series(1, :profiles) AS i
+    """,
+    """
+    INSERT INTO "transaction" (profile, amount, reason, timestamp)
+    SELECT profile.id, 100, 'Seed', now() - make_interval(mins => i)
+    FROM profile, generate_series(1, :transactions_per_profile) AS i
+    WHERE profile.guild_id < 0
+    """,
+    # An old month with a few transactions left
+    """
+    CREATE TABLE transaction_seed_old PARTITION OF "transaction"
+    FOR VALUES FROM ('2000-01-01') TO ('2000-02-01')
+    """,
+    """
+    INSERT INTO "transaction" (profile, amount, reason, timestamp)
+    SELECT profile.id, 100, 'Seed', '2000-01-01'::timestamp + make_interval(days => i)
+    FROM profile, generate_series(1, 3) AS i
+    WHERE profile.guild_id < 0 AND profile.id % 1000 = 0
+    """,
+    """
+    INSERT INTO map_completion (profile, guild_id, ordinal, completed_at)
+    SELECT profile.id, profile.guild_id,
+        row_number() OVER (PARTITION BY profile.guild_id ORDER BY profile.id),
+        now() - make_interval(mins => profile.id)
+    FROM profile WHERE profile.guild_id < 0 AND profile.id % 50 = 0
+    """,
+    "ANALYZE",
+]
+
+SMALL_PARTITIONS_QUERY = """
+SELECT relname FROM pg_class
+WHERE relname = ANY($1::text[]) AND relispartition AND reltuples < $2
+"""
+
+
+def get_hot_queries(
+    user_id: int, profile_id: int
+) -> dict[str, tuple[str, tuple[Any, ...] | dict[str, Any]]]:
+    """
+    Get the hot statements with the values they run with, in order for the
+    `$n` parameters of the repository and by name for the models
+    """
+
+    segments = MapImageGenerator.SEGMENTS
+    return {
+        "profile lookup": (PROFILE_QUERY, (user_id, GUILD_ID)),
+        "balance change": (ADD_POINTS_QUERY, (profile_id, 0, 0)),
+        "map purchase": (
+            BUY_RANDOM_MAP_SEGMENTS_QUERY,
+            (
+                profile_id,
+                segments,
+                (1 << segments) - 1,
+                MAP_ELEMENT_COST,
+                1,
+                "Seed",
+                datetime.utcnow(),
+            ),
+        ),
+        "points ranking": (LEADERBOARD_QUERY, {"guild_id": GUILD_ID}),
+        "map segment ranking": (MAP_SEGMENT_RANKING_QUERY, (GUILD_ID, 10, 0)),
+        "map segment ranking page": (
+            MAP_SEGMENT_RANKING_AFTER_QUERY,
+            (GUILD_ID, 10, 0, user_id, segments // 2),
+        ),
+        "map completion ranking": (MAP_COMPLETION_RANKING_QUERY, (GUILD_ID, 10, 0, 0)),
+        "transaction history": (
+            TRANSACTION_HISTORY_QUERY.format(condition=""),
+            {"profile_id": profile_id, "limit": 10, "offset": 0},
+        ),
+        "transaction history page": (
+            TRANSACTION_HISTORY_QUERY.format(
+                condition=TRANSACTION_HISTORY_AFTER_CONDITION
+            ),
+            {
+                "profile_id": profile_id,
+                "limit": 10,
+                "offset": 0,
+                "timestamp": datetime.utcnow(),
+                "id": 0,
+            },
+        ),
+        "transaction count": (TRANSACTION_COUNT_QUERY, {"profile_id": profile_id}),
+    }
+
+
+def iter_plan_nodes(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+
+def get_seq_scans(plan: dict[str, Any], small_partitions: set[str]) -> list[str]:
+    """Get the relations scanned sequentially, other than the small partitions"""
+
+    return [
+        node["Relation Name"]
+        for node in iter_plan_nodes(plan)
+        # Empty relations, like future partitions, cost nothing to scan
+        if node["Node Type"] == "Seq Scan"
+        and node["Total Cost"] > 0
+        and node["Relation Name"] not in small_partitions
+    ]
+
+
+async def run(profiles: int, guilds: int, transactions_per_profile: int) -> list[str]:
+    """Check the plans of the hot queries and return the names of the failing ones"""
+
+    seed_values = {
+        "profiles": profiles,
+        "guilds": guilds,
+        "transactions_per_profile": transactions_per_profile,
+    }
+
+    failures = []
+    async with databases.Database(get_database_url(), force_rollback=True) as database:
+        for query in SEED_QUERIES:
+            values = {k: v for k, v in seed_values.items() if f":{k}" in query}
+            await database.execute(query, values)
+
+        profile = await database.fetch_one(
+            "SELECT id, user_id FROM profile WHERE guild_id = :guild_id LIMIT 1",
+            {"guild_id": GUILD_ID},
+        )
+        assert profile is not None
+        # The repository's queries go straight to asyncpg, on the connection
+        # of the rolled back transaction
+        connection = database.connection().raw_connection
+
+        hot_queries = get_hot_queries(profile["user_id"], profile["id"])
+        for name, (query, args) in hot_queries.items():
+            explain = f"EXPLAIN (FORMAT JSON) {query}"
+            if isinstance(args, dict):
+                result = await database.fetch_val(explain, args)
+            else:
+                result = await connection.fetchval(explain, *args)
+            plan = json.loads(result)[0]["Plan"]
+
+            relations = [
+                node["Relation Name"]
+                for node in iter_plan_nodes(plan)
+                if "Relation Name" in node
+            ]
+            rows = await connection.fetch(
+                SMALL_PARTITIONS_QUERY, relations, SMALL_PARTITION_ROWS
+            )
+            seq_scans = get_seq_scans(plan, {row["relname"] for row in rows})
+            if seq_scans:
+                failures.append(name)
+                print(f"FAIL {name}: sequential scan on {', '.join(seq_scans)}")
+            else:
+                print(f"OK   {name}")
+
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profiles", type=int, default=100_000)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--transactions-per-profile", type=int, default=10)
+    args = parser.parse_args()
+
+    if asyncio.run(run(args.profiles, args.guilds, args.transactions_per_profile)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
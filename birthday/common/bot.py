@@ -6,7 +6,11 @@ from discord.ext import commands
 from discord.ext.commands import CommandError, errors
 from discord.ext.commands.context import Context
 
-from birthday.models import database
+from birthday.executors import shutdown_shared_executors
+from birthday.metrics import MetricsServer, registry
+from birthday.models import database, ledger, replica, transaction_partitions
+from birthday.pool import InstrumentedPool, instrument_pool
+from birthday.utils import get_env
 
 from .config import Config
 
@@ -26,15 +30,61 @@ class Bot(commands.Bot):
         )
 
         self.start_timestamp = datetime.utcnow()
+        self.database_pool: InstrumentedPool | None = None
+        self.metrics_server: MetricsServer | None = None
 
     async def setup_hook(self) -> None:
         await database.connect()
+        if replica is not database:
+            await replica.connect()
+        self.database_pool = instrument_pool(database)
+        await transaction_partitions.start()
+        ledger.start()
         await self.load_extensions()
+        await self.start_metrics_server()
 
     async def close(self) -> None:
         await super().close()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await ledger.close()
+        shutdown_shared_executors()
+        await transaction_partitions.close()
+        if replica is not database:
+            await replica.disconnect()
         await database.disconnect()
 
+    async def start_metrics_server(self) -> None:
+        port = int(get_env("METRICS_PORT", "0"))
+        if port == 0:
+            return
+
+        registry.gauge(
+            "bot_gateway_latency_seconds", "Discord gateway heartbeat latency"
+        ).set_function(lambda: self.latency)
+        registry.gauge(
+            "bot_ledger_pending", "Transactions waiting to be written"
+        ).set_function(lambda: ledger.pending)
+        if self.database_pool is not None:
+            # Bound with its narrowed type for the callbacks
+            pool: InstrumentedPool = self.database_pool
+            connections = registry.gauge(
+                "bot_db_pool_connections", "Database pool connections by state"
+            )
+            connections.set_function(lambda: pool.stats.in_use, state="in_use")
+            connections.set_function(lambda: pool.stats.idle, state="idle")
+            registry.gauge(
+                "bot_db_pool_waiting", "Callers waiting for a database connection"
+            ).set_function(lambda: pool.stats.waiting)
+            registry.gauge(
+                "bot_db_pool_wait_seconds", "Total time spent acquiring connections"
+            ).set_function(lambda: pool.stats.wait_time)
+
+        self.metrics_server = MetricsServer(
+            registry, get_env("METRICS_HOST", "0.0.0.0"), port
+        )
+        await self.metrics_server.start()
+
     async def load_extension(self, name: str, *, package: str | None = None) -> None:
         if package is None:
             package = self._config._extension_package
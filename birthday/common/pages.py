@@ -0,0 +1,105 @@
+from typing import Awaitable, Callable, Generic, Protocol, TypeVar
+
+__all__ = ("PageSource", "ListPageSource", "KeysetPageSource")
+
+T = TypeVar("T")
+K = TypeVar("K")
+
+# Fetch up to `limit` elements after `offset` elements which follow the key,
+# or from the start if the key is None
+KeysetFetch = Callable[[K | None, int, int], Awaitable[list[T]]]
+
+
+class PageSource(Protocol[T]):
+    """Elements displayed by the `Paginator`, loaded one page at a time"""
+
+    per_page: int
+
+    async def get_page(self, page: int) -> list[T]:
+        ...
+
+    async def get_count(self) -> int:
+        ...
+
+
+class ListPageSource(Generic[T]):
+    """Pages of elements already loaded into memory"""
+
+    def __init__(self, elements: list[T], *, per_page: int = 10) -> None:
+        self.per_page = per_page
+        self._elements = elements
+
+    async def get_page(self, page: int) -> list[T]:
+        start = page * self.per_page
+        return self._elements[start : start + self.per_page]
+
+    async def get_count(self) -> int:
+        return len(self._elements)
+
+
+class KeysetPageSource(Generic[T, K]):
+    """
+    Pages of a query fetched on demand with keyset pagination
+
+    Every page is fetched by seeking past the key of the last element of
+    the nearest earlier page seen so far, so browsing page by page never
+    scans the skipped rows. Only jumping ahead, e.g. wrapping around to the
+    last page, has to skip rows with an offset. The next `prefetch` pages
+    are fetched with the requested one, and only the pages around the
+    current one are kept in memory.
+    """
+
+    def __init__(
+        self,
+        fetch: KeysetFetch[K, T],
+        count: Callable[[], Awaitable[int]],
+        key: Callable[[T], K],
+        *,
+        per_page: int = 10,
+        prefetch: int = 1,
+    ) -> None:
+        self.per_page = per_page
+        self._fetch = fetch
+        self._count = count
+        self._key = key
+        self._prefetch = prefetch
+        self._pages: dict[int, list[T]] = {}
+        # Key of the last element of every full page seen so far
+        self._last_keys: dict[int, K] = {}
+        self._total: int | None = None
+
+    async def get_page(self, page: int) -> list[T]:
+        if (elements := self._pages.get(page)) is None:
+            await self._load(page)
+            elements = self._pages[page]
+
+        # Forget the pages outside of the prefetch window
+        for loaded in list(self._pages):
+            if abs(loaded - page) > self._prefetch:
+                del self._pages[loaded]
+
+        return elements
+
+    async def get_count(self) -> int:
+        if self._total is None:
+            self._total = await self._count()
+        return self._total
+
+    async def _load(self, page: int) -> None:
+        anchor = max((p for p in self._last_keys if p < page), default=None)
+        if anchor is None:
+            after, offset = None, page * self.per_page
+        else:
+            after, offset = self._last_keys[anchor], (page - anchor - 1) * self.per_page
+
+        elements = await self._fetch(
+            after, offset, (self._prefetch + 1) * self.per_page
+        )
+        for i in range(self._prefetch + 1):
+            chunk = elements[i * self.per_page : (i + 1) * self.per_page]
+            if i > 0 and len(chunk) == 0:
+                break
+
+            self._pages[page + i] = chunk
+            if len(chunk) == self.per_page:
+                self._last_keys[page + i] = self._key(chunk[-1])
@@ -3,6 +3,7 @@ from typing import Awaitable, Callable, Generic, TypeVar
 from discord import ButtonStyle, Embed, Interaction, Member, User
 from discord.ui import Button, UserSelect, View, button, select
 
+from birthday.common.pages import ListPageSource, PageSource
 from birthday.constants import EMBED_COLOR
 
 __all__ = ("Paginator", "UserSelectView")
@@ -15,7 +16,7 @@ class Paginator(Generic[T], View):
         self,
         target: Interaction,
         title: str,
-        elements: list[T],
+        elements: list[T] | PageSource[T],
         formatter: Callable[[list[T], int], str],
         *,
         per_page: int = 10,
@@ -24,49 +25,41 @@ class Paginator(Generic[T], View):
         super().__init__(timeout=timeout)
         self._target = target
         self._title = title
-        self._elements = elements
-        self._elements_per_page = per_page
+        if isinstance(elements, list):
+            elements = ListPageSource(elements, per_page=per_page)
+        self._source = elements
         self._current_page = 0
         self._page_formatter = formatter
 
-    @property
-    def total_pages(self) -> int:
-        return (len(self._elements) - 1) // self._elements_per_page + 1
-
     @property
     def page_start(self) -> int:
-        return self._current_page * self._elements_per_page
+        return self._current_page * self._source.per_page
 
-    @property
-    def page_end(self) -> int:
-        return self.page_start + self._elements_per_page
+    async def get_total_pages(self) -> int:
+        return (await self._source.get_count() - 1) // self._source.per_page + 1
 
-    def get_embed(self) -> Embed:
-        page = self._get_page()
+    async def get_embed(self) -> Embed:
+        page = await self._source.get_page(self._current_page)
         description = self._page_formatter(page, self.page_start + 1)
-        footer = f"{self._current_page + 1}/{self.total_pages}"
+        footer = f"{self._current_page + 1}/{await self.get_total_pages()}"
 
         embed = Embed(title=self._title, description=description, color=EMBED_COLOR)
         embed.set_footer(text=footer)
         return embed
 
-    def _get_page(self) -> list[T]:
-        start = self.page_start
-        end = self.page_end
-        return self._elements[start:end]
-
-    def _switch_page(self, count: int) -> None:
-        self._current_page = (self._current_page + count) % self.total_pages
+    async def _switch_page(self, count: int) -> None:
+        total_pages = await self.get_total_pages()
+        self._current_page = (self._current_page + count) % total_pages
 
     @button(emoji="⬅️")
     async def on_left_arrow(self, itx: Interaction, button: Button):
-        self._switch_page(-1)
-        await itx.response.edit_message(embed=self.get_embed())
+        await self._switch_page(-1)
+        await itx.response.edit_message(embed=await self.get_embed())
 
     @button(emoji="➡️")
     async def on_right_arrow(self, itx: Interaction, button: Button):
-        self._switch_page(1)
-        await itx.response.edit_message(embed=self.get_embed())
+        await self._switch_page(1)
+        await itx.response.edit_message(embed=await self.get_embed())
 
     async def on_timeout(self) -> None:
         self.clear_items()
@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import logging
+from concurrent.futures import Executor
+from typing import Callable
+
+__all__ = ("get_shared_executor", "shutdown_shared_executors")
+
+log = logging.getLogger(__name__)
+
+# Outside of the extensions, so reloading an extension doesn't forget them
+_executors: dict[str, Executor] = {}
+
+
+def get_shared_executor(name: str, factory: Callable[[], Executor]) -> Executor:
+    """
+    Get the executor with the name, creating it with the factory on first use
+
+    Extensions use it for executors which must outlive a reload, as views sent
+    before the reload keep using them.
+    """
+
+    if (executor := _executors.get(name)) is None:
+        executor = _executors[name] = factory()
+    return executor
+
+
+def shutdown_shared_executors() -> None:
+    for name, executor in _executors.items():
+        log.info("Shutting down %s executor", name)
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
@@ -5,6 +5,7 @@ from discord.ext.commands import Context, Greedy, NotOwner
 from discord.ext.commands.context import Context
 
 from birthday.common import Bot, Cog
+from birthday.models import leaderboards, profile_cache, transaction_partitions
 
 
 class Management(Cog):
@@ -104,6 +105,36 @@ class Management(Cog):
 
             await ctx.send(f"Cleared commands from {cleared_guilds} guild(s)")
 
+    @commands.command(name="cache")
+    async def cache(self, ctx: Context):
+        """Show cache statistics"""
+
+        lines = [f"Profiles: {profile_cache}", f"Leaderboards: {leaderboards}"]
+        if (map_cog := self.bot.get_cog("Map")) is not None:
+            lines.append(f"Map images: {map_cog.map_image_cache.stats}")  # type: ignore[attr-defined]
+            lines.append(f"Map attachments: {map_cog.map_attachment_cache}")  # type: ignore[attr-defined]
+
+        await ctx.send("\n".join(lines))
+
+    @commands.command(name="pool")
+    async def pool(self, ctx: Context):
+        """Show database connection pool statistics"""
+
+        if self.bot.database_pool is None:
+            return await ctx.send("The database is not connected")
+
+        await ctx.send(str(self.bot.database_pool.stats))
+
+    @commands.command(name="partitions")
+    async def partitions(self, ctx: Context):
+        """Create upcoming transaction partitions and archive expired ones"""
+
+        created, archived = await transaction_partitions.run()
+        await ctx.send(
+            f"Created {len(created)} partition(s): {', '.join(created) or '-'}\n"
+            f"Archived {len(archived)} partition(s): {', '.join(archived) or '-'}"
+        )
+
     @commands.command(name="rs")
     async def reload_and_sync(self, ctx: Context):
         """Reload all loaded extensions and sync global commands to the current guild"""
@@ -1,7 +1,14 @@
-from birthday.common import Bot
+from __future__ import annotations
 
-from .cog import Map
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from birthday.common import Bot
 
 
 async def setup(bot: Bot) -> None:
+    # Imported here, so the asset pack builder of the package runs without the
+    # models and their database settings
+    from .cog import Map
+
     await bot.add_cog(Map(bot))
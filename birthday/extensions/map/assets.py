@@ -0,0 +1,107 @@
+"""
+Raw map asset pack
+
+The pack stores decoded map layers as uncompressed RGBX pixels, so they can be
+memory-mapped instead of decoded. Every process mapping the same pack shares the
+pixels through the page cache.
+
+Layout (little endian):
+
+- header: magic `MAPPACK1`, width (u16), height (u16), layer count (u32)
+- index: one entry per layer, name (16 bytes, NUL padded) and offset (u64)
+- layers: `width * height * 4` bytes each, aligned to the page size
+
+Build the pack with `python -m birthday.extensions.map.build_pack`.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+from os import path
+
+from PIL import Image
+
+MAGIC = b"MAPPACK1"
+MODE = "RGBX"
+HEADER = struct.Struct("<8sHHI")
+ENTRY = struct.Struct("<16sQ")
+
+
+class InvalidPackError(Exception):
+    pass
+
+
+def write_pack(pack_path: str, layers: dict[str, Image.Image]) -> None:
+    """Write the layers to a new pack, replacing the old one atomically"""
+
+    sizes = {image.size for image in layers.values()}
+    if len(sizes) != 1:
+        raise ValueError("All pack layers must have the same size")
+    width, height = sizes.pop()
+    layer_size = width * height * len(MODE)
+
+    offset = _align(HEADER.size + ENTRY.size * len(layers))
+    offsets = []
+    for _ in layers:
+        offsets.append(offset)
+        offset = _align(offset + layer_size)
+
+    temp_path = f"{pack_path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, width, height, len(layers)))
+        for name, layer_offset in zip(layers, offsets):
+            file.write(ENTRY.pack(name.encode(), layer_offset))
+
+        for image, layer_offset in zip(layers.values(), offsets):
+            file.seek(layer_offset)
+            file.write(image.convert(MODE).tobytes())
+        file.truncate(offset)
+
+    os.replace(temp_path, pack_path)
+
+
+def read_pack(pack_path: str) -> dict[str, Image.Image]:
+    """Memory-map the pack and get its layers as read-only images"""
+
+    with open(pack_path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, width, height, count = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise InvalidPackError(f"{pack_path} is not a map asset pack")
+
+    layer_size = width * height * len(MODE)
+    layers = {}
+    for i in range(count):
+        name, offset = ENTRY.unpack_from(buffer, HEADER.size + ENTRY.size * i)
+        if offset + layer_size > len(buffer):
+            raise InvalidPackError(f"{pack_path} is truncated")
+
+        # RGBX images map the buffer directly, without copying the pixels
+        layers[name.rstrip(b"\0").decode()] = Image.frombuffer(
+            MODE,
+            (width, height),
+            memoryview(buffer)[offset : offset + layer_size],
+            "raw",
+            MODE,
+            0,
+            1,
+        )
+
+    return layers
+
+
+def is_pack_fresh(pack_path: str, sources: list[str]) -> bool:
+    """Check if the pack exists and is newer than all of its sources"""
+
+    if not path.exists(pack_path):
+        return False
+
+    pack_mtime = path.getmtime(pack_path)
+    return all(path.getmtime(source) <= pack_mtime for source in sources)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
@@ -0,0 +1,35 @@
+"""
+Build the map asset pack, without loading the cog or touching the database:
+
+    python -m birthday.extensions.map.build_pack [--force]
+
+The Docker image builds it once, at build time.
+"""
+
+import logging
+import sys
+
+from .assets import is_pack_fresh, write_pack
+from .map_image import MapImageGenerator
+
+log = logging.getLogger(__name__)
+
+
+def main() -> None:
+    """Build the map asset pack, unless it is up to date"""
+
+    generator = MapImageGenerator(use_pack=False)
+    if "--force" not in sys.argv and is_pack_fresh(
+        generator.pack_path, generator.get_pack_sources()
+    ):
+        log.info("Map asset pack %s is up to date", generator.pack_path)
+        return
+
+    write_pack(generator.pack_path, generator.get_layers())
+    log.info("Built map asset pack %s", generator.pack_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    main()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class MapImageCacheStats:
+    entries: int
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    evicted_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.entries} entries, {self.size}/{self.max_size} bytes, "
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), "
+            f"{self.evictions} evictions ({self.evicted_bytes} bytes)"
+        )
+
+
+class MapImageCache:
+    """
+    LRU cache of encoded map images keyed by the owned segments bitmask
+
+    The cache is bounded by the total size of the stored images. Images larger
+    than the whole cache are never stored.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._images: OrderedDict[int, bytes] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._evicted_bytes = 0
+
+    def get(self, bitmask: int) -> bytes | None:
+        """Get the cached image for the segments bitmask"""
+
+        image = self._images.get(bitmask)
+        if image is None:
+            self._misses += 1
+            return None
+
+        self._images.move_to_end(bitmask)
+        self._hits += 1
+        return image
+
+    def put(self, bitmask: int, image: bytes) -> None:
+        """Store the image for the segments bitmask, evicting old images if needed"""
+
+        if len(image) > self._max_size:
+            return
+
+        previous = self._images.pop(bitmask, None)
+        if previous is not None:
+            self._size -= len(previous)
+
+        while self._images and self._size + len(image) > self._max_size:
+            _, evicted = self._images.popitem(last=False)
+            self._size -= len(evicted)
+            self._evictions += 1
+            self._evicted_bytes += len(evicted)
+
+        self._images[bitmask] = image
+        self._size += len(image)
+
+    def clear(self) -> None:
+        self._images.clear()
+        self._size = 0
+
+    @property
+    def stats(self) -> MapImageCacheStats:
+        return MapImageCacheStats(
+            entries=len(self._images),
+            size=self._size,
+            max_size=self._max_size,
+            hits=self._hits,
+            misses=self._misses,
+            evictions=self._evictions,
+            evicted_bytes=self._evicted_bytes,
+        )
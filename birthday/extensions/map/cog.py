@@ -1,18 +1,33 @@
+import functools
 import random
-from collections import Counter
 from datetime import datetime
 
 from discord import Embed, Guild, Interaction, Member, app_commands
 from discord.app_commands import AppCommandError, CommandOnCooldown
 
+from birthday.cache import TTLCache
 from birthday.common import Cog
 from birthday.common.bot import Bot
+from birthday.common.pages import KeysetPageSource
 from birthday.common.views import Paginator
 from birthday.constants import EMBED_COLOR
 from birthday.extensions.map.views import MapImageView
-from birthday.models import MapCompletion, MapSegment, Profile, Transaction
+from birthday.metrics import registry, track_command
+from birthday.models import MapCompletion, Profile
+from birthday.utils import get_env
 
+from .cache import MapImageCache
+from .encoder import MapEncoder
 from .map_image import MapImageGenerator
+from .renderer import MapRenderer, get_executor
+from .utils import (
+    ALL_SEGMENTS,
+    announce_map_completion,
+    buy_random_segments,
+    check_map_completion,
+    get_available_segments,
+    get_segments,
+)
 
 
 @app_commands.guild_only()
@@ -22,6 +37,35 @@ class Map(Cog):
     def __init__(self, bot: Bot) -> None:
         super().__init__(bot)
         self.map_image_generator = MapImageGenerator()
+        self.map_image_cache = MapImageCache(
+            int(get_env("MAP_IMAGE_CACHE_MAX_SIZE", str(32 * 1024 * 1024)))
+        )
+        self.map_renderer = MapRenderer(
+            self.map_image_generator,
+            MapEncoder.from_env(),
+            self.map_image_cache,
+            get_executor(),
+            max_canvases=int(get_env("MAP_CANVAS_CACHE_SIZE", "4")),
+        )
+        self.map_attachment_cache: TTLCache[int, str] = TTLCache(
+            ttl=float(get_env("MAP_ATTACHMENT_TTL", str(6 * 60 * 60))),
+            max_entries=4096,
+        )
+        cache_hit_ratio = registry.gauge("bot_cache_hit_ratio", "Cache hit ratio")
+        cache_hit_ratio.set_function(
+            lambda: self.map_image_cache.stats.hit_rate, cache="map_images"
+        )
+        cache_hit_ratio.set_function(
+            lambda: self.map_attachment_cache.hit_rate, cache="map_attachments"
+        )
+
+    async def cog_unload(self) -> None:
+        self.map_renderer.close()
+
+    async def render(self, segments: int) -> bytes:
+        """Render the encoded map image off the event loop"""
+
+        return await self.map_renderer.render(segments)
 
     @app_commands.command(name="mapa")  # type: ignore[arg-type]
     @app_commands.rename(member="użytkownik")
@@ -29,6 +73,7 @@ class Map(Cog):
         member="Użytkownik, którego mapę chcesz sprawdzić (domyślnie Twoją)"
     )
     @app_commands.checks.cooldown(1, 5)
+    @track_command
     async def show_map(self, itx: Interaction, member: Member | None = None):
         """Sprawdź aktualny postęp na mapie"""
 
@@ -39,22 +84,22 @@ class Map(Cog):
         await itx.response.defer()
 
         profile = await Profile.get_for(member.id, member.guild.id)
-        existing_segments = await self._get_existing_segments(profile)
 
         view = MapImageView(
             itx,
             f"Mapa {member.display_name}",
             profile,
-            existing_segments,
-            self.map_image_generator,
+            profile.map_segments,
+            self.map_renderer,
+            self.map_attachment_cache,
         )
-        embed = view.get_embed()
-        file = view.get_map_image()
+        embed, files = await view.get_map()
 
         if member is itx.user and view.can_buy_element():
-            await itx.followup.send(embed=embed, file=file, view=view)
+            await itx.followup.send(embed=embed, files=files, view=view)
         else:
-            await itx.followup.send(embed=embed, file=file)
+            message = await itx.followup.send(embed=embed, files=files, wait=True)
+            view.remember_attachment(profile.map_segments, message)
 
     @show_map.error
     async def show_map_error(self, itx: Interaction, error: AppCommandError):
@@ -66,87 +111,46 @@ class Map(Cog):
         raise error
 
     @app_commands.command(name="mapa-kup")  # type: ignore[arg-type]
+    @track_command
     async def buy_map_element(self, itx: Interaction):
         """Kup losową część mapy"""
 
         assert isinstance(itx.user, Member)
         profile = await Profile.get_for(itx.user.id, itx.user.guild.id)
-        if profile.points < self.MAP_ELEMENT_COST:
-            return await itx.response.send_message(
-                f"Nie masz wystarczająco dukatów, potrzebujesz **{self.MAP_ELEMENT_COST}** 🪙",
-                ephemeral=True,
-            )
-
-        existing_segments = await self._get_existing_segments(profile)
-        available_segments = self._get_available_segments(existing_segments)
-        if len(available_segments) == 0:
-            return await itx.response.send_message(
-                f"Masz już wszystkie części mapy!", ephemeral=True
-            )
-
-        segment = random.choice(available_segments)
-        await MapSegment.objects.create(profile=profile, number=segment)
-        profile.points -= self.MAP_ELEMENT_COST
-        await profile.update()
-        await Transaction.objects.create(
-            profile=profile,
-            amount=-self.MAP_ELEMENT_COST,
-            reason="Kupno części mapy",
-        )
+        purchase = await buy_random_segments(profile, 1)
+        if purchase.bought == 0:
+            return await self._send_purchase_failure(itx, profile)
 
         embed = Embed(
             title="Zakupiono część mapy!",
-            description=f"Masz aktualnie **{len(existing_segments) + 1}/"
+            description=f"Masz aktualnie **{profile.map_segments.bit_count()}/"
             f"{self.map_image_generator.SEGMENTS}** części mapy!",
             color=EMBED_COLOR,
         )
         await itx.response.send_message(embed=embed)
-        await self._check_map_completion(itx, profile)
+        if purchase.completion is not None:
+            await announce_map_completion(itx, purchase.completion)
 
     @app_commands.command(name="mapa-kup-wszystko")  # type: ignore[arg-type]
+    @track_command
     async def buy_all_map_elements(self, itx: Interaction):
         """Kup tyle elementów mapy, na ile Cię stać"""
 
         assert isinstance(itx.user, Member)
         profile = await Profile.get_for(itx.user.id, itx.user.guild.id)
-        if profile.points < self.MAP_ELEMENT_COST:
-            return await itx.response.send_message(
-                f"Nie masz wystarczająco dukatów, potrzebujesz **{self.MAP_ELEMENT_COST}** 🪙",
-                ephemeral=True,
-            )
-
-        existing_segments = await self._get_existing_segments(profile)
-        available_segments = self._get_available_segments(existing_segments)
-        if len(available_segments) == 0:
-            return await itx.response.send_message(
-                f"Masz już wszystkie części mapy!", ephemeral=True
-            )
-
-        segments_to_buy = min(
-            profile.points // self.MAP_ELEMENT_COST,
-            # Limit to the available segments
-            len(available_segments),
-        )
-        segments = random.sample(available_segments, segments_to_buy)
-        await MapSegment.objects.bulk_create(
-            [MapSegment(profile=profile, number=segment) for segment in segments]
-        )
-        profile.points -= segments_to_buy * self.MAP_ELEMENT_COST
-        await profile.update()
-        await Transaction.objects.create(
-            profile=profile,
-            amount=-segments_to_buy * self.MAP_ELEMENT_COST,
-            reason="Kupno części mapy",
-        )
+        purchase = await buy_random_segments(profile)
+        if purchase.bought == 0:
+            return await self._send_purchase_failure(itx, profile)
 
         embed = Embed(
-            title=f"Zakupiono {segments_to_buy} część mapy!",
-            description=f"Masz aktualnie **{len(existing_segments) + segments_to_buy}/"
+            title=f"Zakupiono {purchase.bought.bit_count()} część mapy!",
+            description=f"Masz aktualnie **{profile.map_segments.bit_count()}/"
             f"{self.map_image_generator.SEGMENTS}** części mapy!",
             color=EMBED_COLOR,
         )
         await itx.response.send_message(embed=embed)
-        await self._check_map_completion(itx, profile)
+        if purchase.completion is not None:
+            await announce_map_completion(itx, purchase.completion)
 
     @app_commands.command(name="mapa-dodaj")  # type: ignore[arg-type]
     @app_commands.rename(member="użytkownik")
@@ -155,14 +159,14 @@ class Map(Cog):
         element="Element mapy, który chcesz dodać (domyślnie losowy)",
     )
     @app_commands.default_permissions(administrator=True)
+    @track_command
     async def add_map_element(
         self, itx: Interaction, member: Member, element: int | None
     ):
         """Dodaj użytkownikowi element mapy"""
 
         profile = await Profile.get_for(member.id, member.guild.id)
-        existing_segments = await self._get_existing_segments(profile)
-        available_segments = self._get_available_segments(existing_segments)
+        available_segments = get_available_segments(profile.map_segments)
 
         if element is None:
             element = random.choice(available_segments)
@@ -172,11 +176,11 @@ class Map(Cog):
                 f"Element #{element} jest już na mapie {member.mention}", ephemeral=True
             )
 
-        await MapSegment.objects.create(profile=profile, number=element)
+        await profile.update_map_segments(add=1 << (element - 1))
         await itx.response.send_message(
             f"Dodano element #{element} do mapy {member.mention}"
         )
-        await self._check_map_completion(itx, profile)
+        await check_map_completion(itx, profile)
 
     @app_commands.command(name="mapa-zabierz")  # type: ignore[arg-type]
     @app_commands.rename(member="użytkownik")
@@ -185,60 +189,76 @@ class Map(Cog):
         element="Element mapy, który chcesz zabrać",
     )
     @app_commands.default_permissions(administrator=True)
+    @track_command
     async def remove_map_element(self, itx: Interaction, member: Member, element: int):
         """Zabierz użytkownikowi konkretny element mapy"""
 
         profile = await Profile.get_for(member.id, member.guild.id)
-        segment = await MapSegment.objects.filter(
-            profile=profile, number=element
-        ).get_or_none()
-
-        if segment is None:
+        if element not in get_segments(profile.map_segments):
             return await itx.response.send_message(
                 f"Element #{element} nie jest na mapie {member.mention}", ephemeral=True
             )
 
-        await segment.delete()
+        await profile.update_map_segments(remove=1 << (element - 1))
         await itx.response.send_message(
             f"Zabrano element #{element} z mapy {member.mention}"
         )
 
     @app_commands.command(name="mapa-ranking")  # type: ignore[arg-type]
+    @track_command
     async def completed_map_ranking(self, itx: Interaction):
         """Sprawdź kto ukończył mapę"""
 
         assert isinstance(itx.guild, Guild)
-        completions = (
-            await MapCompletion.objects.filter(profile__guild_id=itx.guild.id)
-            .order_by("completed_at")
-            .all()
+        guild_id = itx.guild.id
+
+        async def fetch(
+            after: int | None, offset: int, limit: int
+        ) -> list[tuple[int, int, datetime]]:
+            return await MapCompletion.get_ranking(
+                guild_id, after=after, offset=offset, limit=limit
+            )
+
+        completions = KeysetPageSource[tuple[int, int, datetime], int](
+            fetch,
+            functools.partial(MapCompletion.count_ranking, guild_id),
+            lambda completion: completion[0],
         )
 
         def format_time(dt: datetime) -> str:
             timestamp = int(dt.timestamp())
             return f"<t:{timestamp}:R>"
 
-        def page_formatter(items: list[MapCompletion], start_position: int) -> str:
+        def page_formatter(
+            items: list[tuple[int, int, datetime]], start_position: int
+        ) -> str:
             return "\n".join(
-                f"{i}. <@{completion.profile.user_id}> - {format_time(completion.completed_at)}"
-                for i, completion in enumerate(items, start_position)
+                f"{ordinal}. <@{user_id}> - {format_time(completed_at)}"
+                for ordinal, user_id, completed_at in items
             )
 
         view = Paginator(itx, "Ukończone mapy", completions, page_formatter)
-        await itx.response.send_message(embed=view.get_embed(), view=view)
+        await itx.response.send_message(embed=await view.get_embed(), view=view)
 
     @app_commands.command(name="mapa-ranking-czesci")  # type: ignore[arg-type]
+    @track_command
     async def segment_ranking(self, itx: Interaction):
         """Sprawdź kto ma najwięcej części mapy"""
 
         assert isinstance(itx.guild, Guild)
-        segments = (
-            await MapSegment.objects.filter(profile__guild_id=itx.guild.id)
-            .select_related("profile")
-            .all()
-        )
-        segment_counts: Counter[int] = Counter(
-            segment.profile.user_id for segment in segments
+        guild_id = itx.guild.id
+
+        async def fetch(
+            after: tuple[int, int] | None, offset: int, limit: int
+        ) -> list[tuple[int, int]]:
+            return await Profile.get_map_segment_ranking(
+                guild_id, after=after, offset=offset, limit=limit
+            )
+
+        segment_counts = KeysetPageSource[tuple[int, int], tuple[int, int]](
+            fetch,
+            functools.partial(Profile.count_map_segment_ranking, guild_id),
+            lambda item: item,
         )
 
         def page_formatter(items: list[tuple[int, int]], start_position: int) -> str:
@@ -247,36 +267,18 @@ class Map(Cog):
                 for i, (user_id, count) in enumerate(items, start_position)
             )
 
-        view = Paginator(
-            itx, "Zebrane części mapy", segment_counts.most_common(), page_formatter
-        )
-        await itx.response.send_message(embed=view.get_embed(), view=view)
-
-    async def _check_map_completion(self, itx: Interaction, profile: Profile):
-        """Check if the user completed the map"""
-
-        existing_segments = await self._get_existing_segments(profile)
-        if len(existing_segments) == self.map_image_generator.SEGMENTS:
-            await MapCompletion.objects.create(profile=profile)
-            existing_completions = await MapCompletion.objects.filter(
-                profile__guild_id=profile.guild_id
-            ).count()
-
-            embed = Embed(
-                title="Ukończono mapę!",
-                description=f"Gratulacje, ukończyłeś/aś mapę jako **{existing_completions}**!",
-                color=EMBED_COLOR,
+        view = Paginator(itx, "Zebrane części mapy", segment_counts, page_formatter)
+        await itx.response.send_message(embed=await view.get_embed(), view=view)
+
+    async def _send_purchase_failure(self, itx: Interaction, profile: Profile):
+        """Explain why nothing was bought, based on the current state of the profile"""
+
+        if profile.map_segments == ALL_SEGMENTS:
+            return await itx.response.send_message(
+                f"Masz już wszystkie części mapy!", ephemeral=True
             )
-            await itx.followup.send(embed=embed)
 
-    async def _get_existing_segments(self, profile: Profile) -> list[int]:
-        return await MapSegment.objects.filter(profile=profile).values_list(
-            "number", flatten=True
+        await itx.response.send_message(
+            f"Nie masz wystarczająco dukatów, potrzebujesz **{self.MAP_ELEMENT_COST}** 🪙",
+            ephemeral=True,
         )
-
-    def _get_available_segments(self, existing_segments: list[int]) -> list[int]:
-        return [
-            i
-            for i in range(1, self.map_image_generator.SEGMENTS + 1)
-            if i not in existing_segments
-        ]
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from enum import Enum
+from io import BytesIO
+from typing import Any
+
+from PIL import Image
+
+from birthday.utils import get_env
+
+
+class EncoderMode(Enum):
+    FAST = "fast"
+    OPTIMIZED = "optimized"
+    PROGRESSIVE = "progressive"
+    WEBP = "webp"
+    TARGET_SIZE = "target-size"
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    encode_time: float
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+@dataclass
+class MapEncoder:
+    """
+    Encode map images with a configurable speed/size trade-off
+
+    - `FAST` - baseline JPEG without optimized Huffman tables
+    - `OPTIMIZED` - baseline JPEG with optimized Huffman tables
+    - `PROGRESSIVE` - progressive JPEG, usually the smallest JPEG
+    - `WEBP` - lossy WebP
+    - `TARGET_SIZE` - the highest JPEG quality which fits in `target_size` bytes
+    """
+
+    mode: EncoderMode = EncoderMode.OPTIMIZED
+    quality: int = 85
+    min_quality: int = 40
+    target_size: int = 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> MapEncoder:
+        return cls(
+            mode=EncoderMode(get_env("MAP_ENCODER_MODE", EncoderMode.OPTIMIZED.value)),
+            quality=int(get_env("MAP_ENCODER_QUALITY", "85")),
+            min_quality=int(get_env("MAP_ENCODER_MIN_QUALITY", "40")),
+            target_size=int(get_env("MAP_ENCODER_TARGET_SIZE", str(1024 * 1024))),
+        )
+
+    @property
+    def extension(self) -> str:
+        return "webp" if self.mode is EncoderMode.WEBP else "jpg"
+
+    def encode(self, image: Image.Image) -> EncodedImage:
+        """Encode the image, measuring the time it took"""
+
+        start = time.perf_counter()
+        if self.mode is EncoderMode.TARGET_SIZE:
+            data = self._encode_target_size(image)
+        else:
+            data = self._save(image, self.quality)
+
+        return EncodedImage(data, time.perf_counter() - start)
+
+    def _encode_target_size(self, image: Image.Image) -> bytes:
+        """Binary search the highest quality which fits in the target size"""
+
+        low, high = self.min_quality, self.quality
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = self._save(image, quality)
+            if len(data) <= self.target_size:
+                best = data
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        # Even the lowest quality doesn't fit, send it anyway
+        if best is None:
+            best = self._save(image, self.min_quality)
+
+        return best
+
+    def _save(self, image: Image.Image, quality: int) -> bytes:
+        params: dict[str, Any]
+        match self.mode:
+            case EncoderMode.OPTIMIZED:
+                params = {"format": "jpeg", "optimize": True}
+            case EncoderMode.PROGRESSIVE:
+                params = {"format": "jpeg", "optimize": True, "progressive": True}
+            case EncoderMode.WEBP:
+                params = {"format": "webp", "method": 4}
+            case _:
+                params = {"format": "jpeg"}
+
+        with BytesIO() as image_binary:
+            image.save(image_binary, quality=quality, **params)
+            return image_binary.getvalue()
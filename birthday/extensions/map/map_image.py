@@ -1,8 +1,13 @@
+import logging
 from functools import cache
 from os import path
 
 from PIL import Image
 
+from .assets import InvalidPackError, is_pack_fresh, read_pack
+
+log = logging.getLogger(__name__)
+
 
 class MapImageGenerator:
     SEGMENT_WIDTH = 250
@@ -13,37 +18,92 @@ class MapImageGenerator:
     WIDTH = SEGMENT_WIDTH * COLUMNS
     HEIGHT = SEGMENT_HEIGHT * ROWS
 
-    def __init__(self) -> None:
+    def __init__(self, *, use_pack: bool = True) -> None:
         """Initialize the map image"""
 
         self.segments_path = path.join(path.dirname(__file__), "segments")
         if not path.exists(self.segments_path):
             raise FileNotFoundError("Map segments directory not found")
         self.background_path = path.join(self.segments_path, "background.jpg")
+        self.pack_path = path.join(self.segments_path, "map.pack")
+
+        layers = self._load_pack() if use_pack else None
+        if layers is None:
+            self._background = self._load_background()
+            self._atlas = self._load_atlas()
+        else:
+            self._background = layers["background"]
+            self._atlas = layers["atlas"]
 
-    def get_image(self, segments: list[int]) -> Image:
+    def get_image(self, segments: list[int]) -> Image.Image:
         """Get the map image"""
 
-        output = self._get_background().copy()
+        output = self._background.copy()
+        self.paste_segments(output, segments)
+
+        return output
+
+    def paste_segments(self, image: Image.Image, segments: list[int]) -> None:
+        """Paste the segments onto an already composed map image"""
 
         for segment in segments:
-            segment_image = Image.open(self._get_segment_path(segment))
-            segment_position = self._get_segment_position(segment)
-            output.paste(segment_image, segment_position)
+            box = self._get_segment_box(segment)
+            image.paste(self._atlas.crop(box), box)
 
-        return output
+    def get_layers(self) -> dict[str, Image.Image]:
+        """Get the decoded layers stored in the asset pack"""
 
-    @cache
-    def _get_background(self) -> Image:
-        """Get the background image"""
+        return {"background": self._background, "atlas": self._atlas}
 
-        return Image.open(self.background_path)
+    def get_pack_sources(self) -> list[str]:
+        """Get the paths of the images the asset pack is built from"""
 
-    @cache
-    def _get_segment(self, segment: int) -> Image:
-        """Get the segment image"""
+        return [self.background_path] + [
+            self._get_segment_path(segment) for segment in range(1, self.SEGMENTS + 1)
+        ]
+
+    def _load_pack(self) -> dict[str, Image.Image] | None:
+        """Memory-map the asset pack, if it is up to date"""
+
+        if not is_pack_fresh(self.pack_path, self.get_pack_sources()):
+            log.info("Map asset pack is missing or outdated, decoding segments")
+            return None
 
-        return Image.open(self._get_segment_path(segment))
+        try:
+            layers = read_pack(self.pack_path)
+        except InvalidPackError:
+            log.exception("Failed to load the map asset pack, decoding segments")
+            return None
+
+        if any(
+            layers.get(name) is None or layers[name].size != (self.WIDTH, self.HEIGHT)
+            for name in ("background", "atlas")
+        ):
+            log.warning("Map asset pack doesn't match the map, decoding segments")
+            return None
+
+        return layers
+
+    def _load_background(self) -> Image.Image:
+        """Decode the background image"""
+
+        with Image.open(self.background_path) as image:
+            return image.convert("RGB")
+
+    def _load_atlas(self) -> Image.Image:
+        """
+        Decode all segments once into a single RGB atlas
+
+        Every segment is placed at its final position on the map, so copying
+        a segment onto the output is a single block copy of the same box.
+        """
+
+        atlas = Image.new("RGB", (self.WIDTH, self.HEIGHT))
+        for segment in range(1, self.SEGMENTS + 1):
+            with Image.open(self._get_segment_path(segment)) as image:
+                atlas.paste(image.convert("RGB"), self._get_segment_position(segment))
+
+        return atlas
 
     @cache
     def _get_segment_path(self, segment: int) -> str:
@@ -57,3 +117,10 @@ class MapImageGenerator:
 
         row, column = divmod(segment - 1, self.COLUMNS)
         return column * self.SEGMENT_WIDTH, row * self.SEGMENT_HEIGHT
+
+    @cache
+    def _get_segment_box(self, segment: int) -> tuple[int, int, int, int]:
+        """Get the box the segment occupies on the map image"""
+
+        x, y = self._get_segment_position(segment)
+        return x, y, x + self.SEGMENT_WIDTH, y + self.SEGMENT_HEIGHT
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+from birthday.executors import get_shared_executor
+from birthday.metrics import registry
+from birthday.utils import get_env
+
+from .cache import MapImageCache
+from .encoder import EncodedImage, MapEncoder
+from .map_image import MapImageGenerator
+from .utils import get_segments
+
+log = logging.getLogger(__name__)
+
+render_duration = registry.histogram(
+    "bot_map_render_duration_seconds", "Duration of map renders in the executor"
+)
+encode_duration = registry.histogram(
+    "bot_map_encode_duration_seconds", "Duration of map image encoding"
+)
+
+# Generator used by the worker processes, each process decodes its own copy
+_process_generator: MapImageGenerator | None = None
+
+
+def _init_process() -> None:
+    global _process_generator
+    _process_generator = MapImageGenerator()
+
+
+def _render_in_process(segments: list[int], encoder: MapEncoder) -> EncodedImage:
+    assert _process_generator is not None
+    return render_map_image(_process_generator, encoder, segments)
+
+
+def render_map_image(
+    generator: MapImageGenerator, encoder: MapEncoder, segments: list[int]
+) -> EncodedImage:
+    """Compose and encode the map image"""
+
+    return encoder.encode(generator.get_image(segments))
+
+
+def update_map_image(
+    generator: MapImageGenerator,
+    encoder: MapEncoder,
+    canvas: Image.Image | None,
+    segments: list[int],
+    new_segments: list[int],
+) -> tuple[Image.Image, EncodedImage]:
+    """Paste the new segments onto the canvas, composing it first if needed"""
+
+    if canvas is None:
+        canvas = generator.get_image(segments)
+    else:
+        generator.paste_segments(canvas, new_segments)
+
+    return canvas, encoder.encode(canvas)
+
+
+def create_executor() -> Executor:
+    """Create the render executor configured by the environment"""
+
+    kind = get_env("MAP_RENDER_EXECUTOR", "thread")
+    workers = int(get_env("MAP_RENDER_WORKERS", "2"))
+
+    if kind == "thread":
+        return ThreadPoolExecutor(workers, thread_name_prefix="map-render")
+    if kind == "process":
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+        )
+    raise ValueError(f"Unknown map render executor: {kind}")
+
+
+def get_executor() -> Executor:
+    """
+    Get the render executor shared by every load of the extension, as views
+    sent before a reload keep rendering with it
+    """
+
+    return get_shared_executor("map-render", create_executor)
+
+
+class MapRenderer:
+    """Render map images in an executor, so the event loop is never blocked"""
+
+    def __init__(
+        self,
+        generator: MapImageGenerator,
+        encoder: MapEncoder,
+        cache: MapImageCache,
+        executor: Executor,
+        *,
+        max_canvases: int = 4,
+    ) -> None:
+        self._generator = generator
+        self._encoder = encoder
+        self._cache = cache
+        self._executor = executor
+        self._pending: dict[int, asyncio.Future[EncodedImage]] = {}
+        # Composed full-size maps keyed by their exact segments bitmask, most
+        # recently used last. Each one takes a few megabytes.
+        self._canvases: OrderedDict[int, Image.Image] = OrderedDict()
+        self._max_canvases = max_canvases
+
+    @property
+    def cache(self) -> MapImageCache:
+        return self._cache
+
+    @property
+    def extension(self) -> str:
+        return self._encoder.extension
+
+    async def render(self, bitmask: int) -> bytes:
+        """Get the encoded map image, rendering it if it is not cached yet"""
+
+        if (cached := self._cache.get(bitmask)) is not None:
+            return cached
+
+        # Concurrent requests for the same map share a single render
+        if (pending := self._pending.get(bitmask)) is not None:
+            return (await asyncio.shield(pending)).data
+
+        loop = asyncio.get_running_loop()
+        if isinstance(self._executor, ProcessPoolExecutor):
+            future = loop.run_in_executor(
+                self._executor, _render_in_process, get_segments(bitmask), self._encoder
+            )
+        else:
+            future = loop.run_in_executor(
+                self._executor,
+                render_map_image,
+                self._generator,
+                self._encoder,
+                get_segments(bitmask),
+            )
+
+        self._pending[bitmask] = future
+        try:
+            with render_duration.time(kind="full"):
+                encoded = await asyncio.shield(future)
+        finally:
+            del self._pending[bitmask]
+
+        return self._store(bitmask, encoded)
+
+    async def render_update(self, previous: int, bitmask: int) -> bytes:
+        """
+        Get the encoded map image after the map changed from the `previous`
+        segments bitmask to `bitmask`
+
+        If only segments were added and the canvas of the previous map is
+        still kept, just the new segments are pasted onto it. The canvas is
+        then kept for the new bitmask instead. Removed segments can't be
+        erased from a canvas, so then the map is rendered from scratch. Worker
+        processes cannot share canvases, so with a process pool this is
+        always a full render.
+        """
+
+        if isinstance(self._executor, ProcessPoolExecutor) or previous & ~bitmask:
+            return await self.render(bitmask)
+
+        if (cached := self._cache.get(bitmask)) is not None:
+            return cached
+
+        # Taken out while it's drawn on, so no other update can use it meanwhile
+        canvas = self._canvases.pop(previous, None)
+        loop = asyncio.get_running_loop()
+        with render_duration.time(kind="update"):
+            canvas, encoded = await loop.run_in_executor(
+                self._executor,
+                update_map_image,
+                self._generator,
+                self._encoder,
+                canvas,
+                get_segments(bitmask),
+                get_segments(bitmask & ~previous),
+            )
+
+        self._canvases[bitmask] = canvas
+        self._canvases.move_to_end(bitmask)
+        while len(self._canvases) > self._max_canvases:
+            self._canvases.popitem(last=False)
+
+        return self._store(bitmask, encoded)
+
+    def render_inline(self, bitmask: int) -> bytes:
+        """
+        Render the map image on the calling thread, for when the executor
+        fails. This blocks the event loop for the whole render.
+        """
+
+        with render_duration.time(kind="inline"):
+            encoded = render_map_image(
+                self._generator, self._encoder, get_segments(bitmask)
+            )
+        return self._store(bitmask, encoded)
+
+    def _store(self, bitmask: int, image: EncodedImage) -> bytes:
+        encode_duration.observe(image.encode_time, mode=self._encoder.mode.value)
+        log.debug(
+            "Encoded map %#010x (%s): %d bytes in %.1fms",
+            bitmask,
+            self._encoder.mode.value,
+            image.size,
+            image.encode_time * 1000,
+        )
+        self._cache.put(bitmask, image.data)
+        return image.data
+
+    def close(self) -> None:
+        """Free the kept canvases, the executor is left running for other renderers"""
+
+        log.info("Closing map renderer, cache: %s", self._cache.stats)
+        self._canvases.clear()
@@ -1,38 +1,65 @@
 from discord import Embed, Interaction
 
-from birthday.constants import EMBED_COLOR
-from birthday.models import MapCompletion, MapSegment, Profile
+from birthday.constants import EMBED_COLOR, MAP_ELEMENT_COST
+from birthday.models import MapCompletion, MapPurchase, Profile
 
 from .map_image import MapImageGenerator
 
+# Bitmask of a completed map
+ALL_SEGMENTS = (1 << MapImageGenerator.SEGMENTS) - 1
+
 
 async def check_map_completion(itx: Interaction, profile: Profile):
-    """Check if the user completed the map"""
-
-    existing_segments = await get_existing_segments(profile)
-    if len(existing_segments) == MapImageGenerator.SEGMENTS:
-        await MapCompletion.objects.create(profile=profile)
-        existing_completions = await MapCompletion.objects.filter(
-            profile__guild_id=profile.guild_id
-        ).count()
-
-        embed = Embed(
-            title="Ukończono mapę!",
-            description=f"Gratulacje, ukończyłeś/aś mapę jako **{existing_completions}**!",
-            color=EMBED_COLOR,
-        )
-        await itx.followup.send(embed=embed)
-
-
-async def get_existing_segments(profile: Profile) -> list[int]:
-    return await MapSegment.objects.filter(profile=profile).values_list(
-        "number", flatten=True
+    """Record the completion of the map if the user completed it"""
+
+    if profile.map_segments == ALL_SEGMENTS:
+        if (ordinal := await MapCompletion.record(profile)) is not None:
+            await announce_map_completion(itx, ordinal)
+
+
+async def announce_map_completion(itx: Interaction, ordinal: int):
+    embed = Embed(
+        title="Ukończono mapę!",
+        description=f"Gratulacje, ukończyłeś/aś mapę jako **{ordinal}**!",
+        color=EMBED_COLOR,
+    )
+    await itx.followup.send(embed=embed)
+
+
+async def buy_random_segments(
+    profile: Profile, limit: int | None = None
+) -> MapPurchase:
+    """
+    Buy up to `limit` random segments missing from the map of the profile,
+    as many as it can afford
+    """
+
+    return await profile.buy_random_map_segments(
+        MapImageGenerator.SEGMENTS,
+        MAP_ELEMENT_COST,
+        "Kupno części mapy",
+        limit=limit,
     )
 
 
-def get_available_segments(existing_segments: list[int]) -> list[int]:
+def get_segments(bitmask: int) -> list[int]:
+    """Get the segments with their bits set in the bitmask"""
+
     return [
-        i
-        for i in range(1, MapImageGenerator.SEGMENTS + 1)
-        if i not in existing_segments
+        i for i in range(1, MapImageGenerator.SEGMENTS + 1) if bitmask >> (i - 1) & 1
     ]
+
+
+def get_available_segments(bitmask: int) -> list[int]:
+    """Get the segments missing from the bitmask"""
+
+    return get_segments(~bitmask & ALL_SEGMENTS)
+
+
+def get_segments_bitmask(segments: list[int]) -> int:
+    """Get a bitmask with the bit `segment - 1` set for every segment"""
+
+    bitmask = 0
+    for segment in segments:
+        bitmask |= 1 << (segment - 1)
+    return bitmask
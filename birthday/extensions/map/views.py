@@ -1,27 +1,31 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 from io import BytesIO
-from random import choice
 
-from discord import ButtonStyle, Embed, File, Interaction
+from discord import ButtonStyle, Embed, File, Interaction, Message
 from discord.ui import Button, View, button
 
+from birthday.cache import TTLCache
 from birthday.constants import EMBED_COLOR, MAP_ELEMENT_COST
 from birthday.extensions.map.map_image import MapImageGenerator
-from birthday.extensions.map.utils import get_available_segments
-from birthday.models import MapSegment, Profile
+from birthday.extensions.map.renderer import MapRenderer
+from birthday.extensions.map.utils import buy_random_segments, get_available_segments
+from birthday.models import Profile
 
+log = logging.getLogger(__name__)
 
-class MapImageView(View):
-    FILENAME = "mapa.jpg"
 
+class MapImageView(View):
     def __init__(
         self,
         target: Interaction,
         title: str,
         profile: Profile,
-        segments: list[int],
-        image_generator: MapImageGenerator,
+        segments: int,
+        renderer: MapRenderer,
+        attachment_cache: TTLCache[int, str],
         *,
         timeout: float | None = None,
     ) -> None:
@@ -29,35 +33,54 @@ class MapImageView(View):
         self._target = target
         self._title = title
         self._profile = profile
+        # Bitmask of the segments on the map
         self._segments = segments
         self._available_segments = get_available_segments(segments)
-        self._image_generator = image_generator
+        self._renderer = renderer
+        self._attachment_cache = attachment_cache
+        # Purchases edit the message one at a time, so the last edit shows
+        # the latest map
+        self._edit_lock = asyncio.Lock()
+
+    @property
+    def filename(self) -> str:
+        return f"mapa.{self._renderer.extension}"
 
-    def get_embed(self) -> Embed:
+    def get_embed(self, image_url: str | None = None) -> Embed:
         description = self.get_description()
         embed = Embed(title=self._title, description=description, color=EMBED_COLOR)
-        embed.set_image(url=f"attachment://{self.FILENAME}")
+        embed.set_image(url=image_url or f"attachment://{self.filename}")
 
         return embed
 
     def get_description(self) -> str:
         description = (
-            f"Masz już **{len(self._segments)}/{MapImageGenerator.SEGMENTS}** "
+            f"Masz już **{self._segments.bit_count()}/{MapImageGenerator.SEGMENTS}** "
             f"części mapy!"
         )
-        if len(self._segments) == MapImageGenerator.SEGMENTS:
+        if self._segments.bit_count() == MapImageGenerator.SEGMENTS:
             description += " Gratulacje!"
 
         return description
 
-    def get_map_image(self) -> File:
-        with BytesIO() as image_binary:
-            map_image = self._image_generator.get_image(self._segments)
-            map_image.save(image_binary, format="jpeg", optimize=True, quality=85)
-            image_binary.seek(0)
-            file = File(image_binary, self.FILENAME)
+    async def get_map(self) -> tuple[Embed, list[File]]:
+        """Get the map embed and its attachments, reusing an uploaded image if possible"""
+
+        if (url := self._attachment_cache.get(self._segments)) is not None:
+            return self.get_embed(url), []
+
+        image = await self._renderer.render(self._segments)
+        return self.get_embed(), [File(BytesIO(image), self.filename)]
+
+    def remember_attachment(self, segments: int, message: Message) -> None:
+        """
+        Remember the uploaded map image, so it can be reused by later embeds.
+        Only messages that are never edited qualify, as Discord deletes the
+        attachments replaced by an edit.
+        """
 
-        return file
+        if len(message.attachments) > 0:
+            self._attachment_cache.put(segments, message.attachments[0].url)
 
     def can_buy_element(self) -> bool:
         return (
@@ -83,26 +106,45 @@ class MapImageView(View):
                 ephemeral=True,
             )
 
-        segment = choice(self._available_segments)
-        self._segments.append(segment)
-        self._available_segments.remove(segment)
-
-        await MapSegment.objects.create(profile=self._profile, number=segment)
-        self._profile.points -= MAP_ELEMENT_COST
-        await self._profile.update()
+        previous = self._segments
+        purchase = await buy_random_segments(self._profile, 1)
+        # The purchase returns the current state of the map even if it failed
+        self._segments = self._profile.map_segments
+        self._available_segments = get_available_segments(self._segments)
+        if purchase.bought == 0:
+            return await itx.response.send_message(
+                f"Nie masz wystarczająco dukatów, potrzebujesz **{MAP_ELEMENT_COST}** 🪙",
+                ephemeral=True,
+            )
 
         embed = Embed(
             title="Zakupiono część mapy!",
-            description=f"Masz aktualnie **{len(self._segments)}/"
-            f"{self._image_generator.SEGMENTS}** części mapy!",
+            description=f"Masz aktualnie **{self._segments.bit_count()}/"
+            f"{MapImageGenerator.SEGMENTS}** części mapy!",
             color=EMBED_COLOR,
         )
         await itx.response.send_message(embed=embed, ephemeral=True)
 
-        new_map_file = self.get_map_image()
-        await self._target.edit_original_response(
-            embed=self.get_embed(), attachments=[new_map_file]
-        )
+        async with self._edit_lock:
+            segments = self._segments
+            url = self._attachment_cache.get(segments)
+            if url is not None:
+                await self._target.edit_original_response(
+                    embed=self.get_embed(url), attachments=[]
+                )
+            else:
+                try:
+                    image = await self._renderer.render_update(previous, segments)
+                except Exception:
+                    # The segment is paid for already, so the map has to be shown
+                    log.exception("Failed to render map %#010x", segments)
+                    image = self._renderer.render_inline(segments)
+
+                # Not remembered, the next purchase edits the message again
+                new_map_file = File(BytesIO(image), self.filename)
+                await self._target.edit_original_response(
+                    embed=self.get_embed(), attachments=[new_map_file]
+                )
 
         if not self.can_buy_element():
             button.disabled = True
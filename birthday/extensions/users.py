@@ -1,10 +1,16 @@
+import functools
+from datetime import datetime
+
 from discord import Embed, Guild, Interaction, Member, User, app_commands
 
 from birthday.common import Bot, Cog
 from birthday.common.bot import Bot
+from birthday.common.pages import KeysetPageSource, PageSource
 from birthday.common.views import Paginator, UserSelectView
 from birthday.constants import EMBED_COLOR
-from birthday.models import Profile, Transaction
+from birthday.leaderboard import LeaderboardPageSource
+from birthday.metrics import track_command
+from birthday.models import Profile, Transaction, leaderboards
 from birthday.utils import get_env
 
 
@@ -15,6 +21,7 @@ class Users(Cog):
     @app_commands.describe(
         member="Użytkownik, którego stan konta chcesz sprawdzić (domyślnie Twój)"
     )
+    @track_command
     async def points(self, itx: Interaction, member: Member | None = None):
         """Sprawdź ile ktoś ma dukatów"""
 
@@ -37,24 +44,57 @@ class Users(Cog):
         await itx.response.send_message(embed=embed)
 
     @app_commands.command(name="dukaty-ranking")  # type: ignore[arg-type]
+    @track_command
     async def points_ranking(self, itx: Interaction):
         """Sprawdź ranking osób z największą ilością dukatów"""
 
         assert isinstance(itx.guild, Guild)
-        top_profiles = (
-            await Profile.objects.filter(guild_id=itx.guild.id)
-            .order_by("-points")
-            .all()
-        )
+        leaderboard = await leaderboards.get(itx.guild.id)
 
-        def page_formatter(items: list[Profile], start_position: int) -> str:
+        def page_formatter(items: list[tuple[int, int]], start_position: int) -> str:
             return "\n".join(
-                f"{i}. <@{profile.user_id}> - **{profile.points}** 🪙"
-                for i, profile in enumerate(items, start_position)
+                f"{i}. <@{user_id}> - **{points}** 🪙"
+                for i, (user_id, points) in enumerate(items, start_position)
             )
 
-        view = Paginator(itx, "Ranking dukatowy 🪙", top_profiles, page_formatter)
-        await itx.response.send_message(embed=view.get_embed(), view=view)
+        view = Paginator(
+            itx,
+            "Ranking dukatowy 🪙",
+            LeaderboardPageSource(leaderboard),
+            page_formatter,
+        )
+        await itx.response.send_message(embed=await view.get_embed(), view=view)
+
+    @app_commands.command(name="dukaty-miejsce")  # type: ignore[arg-type]
+    @app_commands.rename(member="użytkownik")
+    @app_commands.describe(
+        member="Użytkownik, którego miejsce w rankingu chcesz sprawdzić (domyślnie Twoje)"
+    )
+    @track_command
+    async def points_rank(self, itx: Interaction, member: Member | None = None):
+        """Sprawdź swoje miejsce w rankingu dukatowym"""
+
+        if member is None:
+            assert isinstance(itx.user, Member)
+            member = itx.user
+
+        profile = await Profile.get_for(member.id, member.guild.id)
+        leaderboard = await leaderboards.get(member.guild.id)
+        if member.id not in leaderboard:
+            # Profiles created outside of the bot after the leaderboard was
+            # loaded are missing from it
+            leaderboard.update(member.id, profile.points)
+        rank = leaderboard.rank(member.id)
+        points = leaderboard.get_points(member.id)
+        assert rank is not None
+
+        embed = Embed(
+            title="Miejsce w rankingu",
+            description=f"{member.mention} zajmuje **{rank}/{len(leaderboard)}** "
+            f"miejsce z **{points}** 🪙",
+            color=EMBED_COLOR,
+        )
+        await itx.response.send_message(embed=embed)
 
     @app_commands.command(name="dukaty-dodaj")  # type: ignore[arg-type]
     @app_commands.rename(member="użytkownik", amount="ilość", reason="powód")
@@ -64,6 +104,7 @@ class Users(Cog):
         reason="Powód dodania dukatów",
     )
     @app_commands.default_permissions(administrator=True)
+    @track_command
     async def points_add(
         self, itx: Interaction, member: Member, amount: int, reason: str = ""
     ):
@@ -75,9 +116,7 @@ class Users(Cog):
             )
 
         profile = await Profile.get_for(member.id, member.guild.id)
-        profile.points += amount
-        await profile.update()
-        await Transaction.objects.create(profile=profile, amount=amount, reason=reason)
+        await profile.add_points(amount, reason)
 
         embed = Embed(
             title="Dukaty wleciały na konto!",
@@ -93,6 +132,7 @@ class Users(Cog):
         reason="Powód dodania dukatów",
     )
     @app_commands.default_permissions(administrator=True)
+    @track_command
     async def points_add_multiple(
         self, itx: Interaction, amount: int, reason: str = ""
     ):
@@ -108,18 +148,9 @@ class Users(Cog):
 
         async def accept_callback(itx: Interaction, users: list[Member | User]) -> None:
             assert isinstance(itx.guild, Guild)
-            updated_profiles: list[Profile] = []
-            transactions: list[Transaction] = []
-            for user in users:
-                profile = await Profile.get_for(user.id, itx.guild.id)
-                profile.points += amount
-                updated_profiles.append(profile)
-                transactions.append(
-                    Transaction(profile=profile, amount=amount, reason=reason)
-                )
-
-            await Profile.objects.bulk_update(updated_profiles, ["points"])
-            await Transaction.objects.bulk_create(transactions)
+            updated_profiles = await Profile.bulk_add_points(
+                itx.guild.id, {user.id: amount for user in users}, reason
+            )
 
             users_str = ", ".join(
                 f"<@{profile.user_id}>" for profile in updated_profiles
@@ -147,6 +178,7 @@ class Users(Cog):
     @app_commands.describe(
         member="Użytkownik, którego transakcje chcesz zobaczyć (domyślnie Twoje)",
     )
+    @track_command
     async def transactions(self, itx: Interaction, member: Member | None = None):
         """Sprawdź historię transakcji dukatów"""
 
@@ -154,11 +186,25 @@ class Users(Cog):
             assert isinstance(itx.user, Member)
             member = itx.user
 
-        transactions = (
-            await Transaction.objects.filter(profile__user_id=member.id)
-            .order_by("-timestamp")
-            .all()
-        )
+        # Someone without a profile has no transactions, and looking them up
+        # shouldn't create one
+        profile = await Profile.get_existing(member.id, member.guild.id)
+        transactions: list[Transaction] | PageSource[Transaction] = []
+        if profile is not None:
+            profile_id = profile.id
+
+            async def fetch(
+                after: tuple[datetime, int] | None, offset: int, limit: int
+            ) -> list[Transaction]:
+                return await Transaction.get_history(
+                    profile_id, after=after, offset=offset, limit=limit
+                )
+
+            transactions = KeysetPageSource[Transaction, tuple[datetime, int]](
+                fetch,
+                functools.partial(Transaction.count_history, profile_id),
+                lambda transaction: (transaction.timestamp, transaction.id),
+            )
 
         def page_formatter(items: list[Transaction], _: int) -> str:
             return "\n".join(
@@ -172,7 +218,7 @@ class Users(Cog):
             transactions,
             page_formatter,
         )
-        await itx.response.send_message(embed=view.get_embed(), view=view)
+        await itx.response.send_message(embed=await view.get_embed(), view=view)
 
 
 async def setup(bot: Bot) -> None:
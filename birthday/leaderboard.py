@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import random
+from collections import defaultdict
+from typing import Awaitable, Callable, Iterable
+
+__all__ = ("Leaderboard", "Leaderboards", "LeaderboardPageSource", "SkipList")
+
+Key = tuple[int, int]
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Key, levels: int) -> None:
+        self.key = key
+        self.next: list[_Node | None] = [None] * levels
+        # Number of nodes the link at each level skips over, including the
+        # node it points to. Meaningless for links to the end of the list.
+        self.width = [1] * levels
+
+
+class SkipList:
+    """
+    Sorted unique keys, which can also be looked up by their position
+
+    Every operation takes O(log n) expected time, and slicing the keys takes
+    an extra step for every returned key.
+    """
+
+    MAX_LEVELS = 32
+
+    def __init__(self) -> None:
+        self._head = _Node((0, 0), self.MAX_LEVELS)
+        self._size = 0
+        # Highest level with any links, the ones above it are skipped
+        self._levels = 1
+
+    def add(self, key: Key) -> None:
+        # Last node before the key at every level, and its position
+        chain: list[_Node] = [self._head] * self.MAX_LEVELS
+        positions = [0] * self.MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while (following := node.next[level]) is not None and following.key < key:
+                position += node.width[level]
+                node = following
+            chain[level], positions[level] = node, position
+
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+
+        new = _Node(key, levels)
+        for level in range(levels):
+            previous = chain[level]
+            distance = position + 1 - positions[level]
+            new.next[level] = previous.next[level]
+            new.width[level] = previous.width[level] - distance + 1
+            previous.next[level] = new
+            previous.width[level] = distance
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._levels = max(self._levels, levels)
+        self._size += 1
+
+    def remove(self, key: Key) -> None:
+        chain: list[_Node] = [self._head] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while (following := node.next[level]) is not None and following.key < key:
+                node = following
+            chain[level] = node
+
+        removed = node.next[0]
+        if removed is None or removed.key != key:
+            raise KeyError(key)
+
+        for level in range(self._levels):
+            previous = chain[level]
+            if previous.next[level] is removed:
+                previous.next[level] = removed.next[level]
+                previous.width[level] += removed.width[level] - 1
+            else:
+                previous.width[level] -= 1
+        self._size -= 1
+
+    def index(self, key: Key) -> int:
+        """Get the number of keys lower than the key"""
+
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while (following := node.next[level]) is not None and following.key < key:
+                position += node.width[level]
+                node = following
+        return position
+
+    def slice(self, start: int, stop: int) -> list[Key]:
+        """Get the keys at the positions from `start` up to `stop`"""
+
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while (following := node.next[level]) is not None and (
+                position + node.width[level] <= start
+            ):
+                position += node.width[level]
+                node = following
+
+        keys: list[Key] = []
+        current = node.next[0]
+        while current is not None and len(keys) < stop - start:
+            keys.append(current.key)
+            current = current.next[0]
+        return keys
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class Leaderboard:
+    """Users of a guild ordered by their points, most points first"""
+
+    def __init__(self) -> None:
+        self._points: dict[int, int] = {}
+        # (-points, user_id) keys
+        self._keys = SkipList()
+
+    def update(self, user_id: int, points: int) -> None:
+        """Move the user to their place for the new amount of points"""
+
+        old_points = self._points.get(user_id)
+        if old_points == points:
+            return
+
+        if old_points is not None:
+            self._keys.remove((-old_points, user_id))
+        self._points[user_id] = points
+        self._keys.add((-points, user_id))
+
+    def merge(self, entries: Iterable[tuple[int, int]]) -> None:
+        """Add the (user ID, points) entries of users missing from the leaderboard"""
+
+        for user_id, points in entries:
+            if user_id not in self._points:
+                self._points[user_id] = points
+                self._keys.add((-points, user_id))
+
+    def get_points(self, user_id: int) -> int | None:
+        return self._points.get(user_id)
+
+    def rank(self, user_id: int) -> int | None:
+        """Get the 1-based place of the user, ties are ordered by user ID"""
+
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return self._keys.index((-points, user_id)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> list[tuple[int, int]]:
+        """Get (user ID, points) pairs starting at the `offset`-th place"""
+
+        return [
+            (user_id, -points)
+            for points, user_id in self._keys.slice(offset, offset + limit)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._points
+
+
+class Leaderboards:
+    """
+    Per-guild leaderboards, loaded from the database once and then kept up to
+    date with every balance change
+    """
+
+    def __init__(
+        self, fetch: Callable[[int], Awaitable[list[tuple[int, int]]]]
+    ) -> None:
+        self._fetch = fetch
+        self._boards: dict[int, Leaderboard] = {}
+        self._loaded: set[int] = set()
+        self._locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def get(self, guild_id: int) -> Leaderboard:
+        if guild_id not in self._loaded:
+            async with self._locks[guild_id]:
+                if guild_id not in self._loaded:
+                    await self._load(guild_id)
+
+        return self._boards[guild_id]
+
+    def update(self, guild_id: int, user_id: int, points: int) -> None:
+        if (board := self._boards.get(guild_id)) is not None:
+            board.update(user_id, points)
+
+    def clear(self) -> None:
+        self._boards.clear()
+        self._loaded.clear()
+
+    async def _load(self, guild_id: int) -> None:
+        # Balance changes made while the rows are fetched go to the new board
+        # and are newer than the fetched rows
+        board = self._boards[guild_id] = Leaderboard()
+        try:
+            entries = await self._fetch(guild_id)
+        except BaseException:
+            del self._boards[guild_id]
+            raise
+
+        board.merge(entries)
+        self._loaded.add(guild_id)
+
+    def __str__(self) -> str:
+        entries = sum(len(board) for board in self._boards.values())
+        return f"{len(self._loaded)} guilds, {entries} entries"
+
+
+class LeaderboardPageSource:
+    """Pages of (user ID, points) pairs of a leaderboard, for the `Paginator`"""
+
+    def __init__(self, leaderboard: Leaderboard, *, per_page: int = 10) -> None:
+        self.per_page = per_page
+        self._leaderboard = leaderboard
+
+    async def get_page(self, page: int) -> list[tuple[int, int]]:
+        return self._leaderboard.top(self.per_page, page * self.per_page)
+
+    async def get_count(self) -> int:
+        return len(self._leaderboard)
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import AsyncIterator, NamedTuple
+
+import asyncpg
+import databases
+
+__all__ = ("LedgerEntry", "LedgerWriter")
+
+log = logging.getLogger(__name__)
+
+INSERT_ENTRIES_QUERY = """
+INSERT INTO "transaction" (profile, amount, reason, timestamp)
+SELECT * FROM unnest(
+    CAST(:profiles AS integer[]),
+    CAST(:amounts AS integer[]),
+    CAST(:reasons AS varchar[]),
+    CAST(:timestamps AS timestamp[])
+)
+"""
+
+# Errors of entries the database will never accept, e.g. with a too long reason
+REJECTED_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class LedgerEntry(NamedTuple):
+    profile: int
+    amount: int
+    reason: str
+    timestamp: datetime
+
+
+class LedgerWriter:
+    """
+    Write-behind buffer for `Transaction` rows
+
+    Entries are written in batches with a single multi-row insert, every
+    `flush_interval` seconds or as soon as `batch_size` entries are pending.
+    Balance changes hold room for their entries with `reserve` before they
+    are made, which waits while `max_pending` entries are waiting, so
+    `record` never waits after the balance has changed. Until the writer is
+    started, entries are written immediately.
+
+    A batch which fails is written again row by row. Rows the database
+    rejects, and everything still unwritten when the writer is closed, are
+    appended to the `dead_letter_path` file as JSON lines instead of being
+    dropped.
+    """
+
+    def __init__(
+        self,
+        database: databases.Database,
+        *,
+        flush_interval: float,
+        batch_size: int,
+        max_pending: int,
+        dead_letter_path: str,
+    ) -> None:
+        self._database = database
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._dead_letter_path = dead_letter_path
+        self._entries: list[LedgerEntry] = []
+        # Entries which failed to be written, retried first
+        self._failed: list[LedgerEntry] = []
+        # Room held by `reserve` for entries about to be recorded
+        self._reserved = 0
+        self._room = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Write all pending entries and stop the writer"""
+
+        if self._task is None:
+            return
+
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+        unwritten = self._failed + self._entries
+        self._failed, self._entries = [], []
+        if len(unwritten) > 0:
+            self._dead_letter(unwritten)
+
+    @asynccontextmanager
+    async def reserve(self, count: int = 1) -> AsyncIterator[None]:
+        """Wait for room for `count` entries and hold it until the block exits"""
+
+        if self._task is None or self._closing:
+            yield
+            return
+
+        async with self._room:
+            await self._room.wait_for(lambda: self._has_room(count))
+            self._reserved += count
+        try:
+            yield
+        finally:
+            async with self._room:
+                self._reserved -= count
+                self._room.notify_all()
+
+    async def record(
+        self, profile: int, amount: int, reason: str, timestamp: datetime
+    ) -> None:
+        entry = LedgerEntry(profile, amount, reason, timestamp)
+        if self._task is None or self._closing:
+            if len(await self._write_each([entry])) > 0:
+                self._dead_letter([entry])
+            return
+
+        self._entries.append(entry)
+        if len(self._entries) >= self._batch_size:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._entries) + len(self._failed)
+
+    def _has_room(self, count: int) -> bool:
+        # A reservation larger than the buffer gets it all to itself
+        used = self.pending + self._reserved
+        return used == 0 or used + count <= self._max_pending
+
+    async def _run(self) -> None:
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            self._wakeup.clear()
+
+            await self._flush()
+            async with self._room:
+                self._room.notify_all()
+            if self._closing:
+                return
+
+    async def _flush(self) -> None:
+        if len(self._failed) > 0:
+            self._failed = await self._write_each(self._failed)
+            if len(self._failed) > 0:
+                return
+
+        while len(self._entries) > 0:
+            batch = self._entries[: self._batch_size]
+            del self._entries[: self._batch_size]
+            try:
+                await self._write(batch)
+            except Exception:
+                log.exception("Failed to write %d ledger entries", len(batch))
+                # One bad row fails the whole batch, so write the rest without it
+                self._failed = await self._write_each(batch)
+                if len(self._failed) > 0:
+                    return
+
+    async def _write_each(self, entries: list[LedgerEntry]) -> list[LedgerEntry]:
+        """
+        Write the entries one at a time and dead-letter the ones the database
+        rejects, returning the entries left after any other error
+        """
+
+        for i, entry in enumerate(entries):
+            try:
+                await self._write([entry])
+            except REJECTED_ERRORS:
+                log.exception("Ledger entry rejected by the database: %s", entry)
+                self._dead_letter([entry])
+            except Exception:
+                log.exception("Failed to write %d ledger entries", len(entries) - i)
+                return entries[i:]
+
+        return []
+
+    def _dead_letter(self, entries: list[LedgerEntry]) -> None:
+        lines = [
+            json.dumps({**entry._asdict(), "timestamp": entry.timestamp.isoformat()})
+            for entry in entries
+        ]
+        try:
+            with open(self._dead_letter_path, "a", encoding="utf-8") as file:
+                file.writelines(f"{line}\n" for line in lines)
+        except OSError:
+            # The log is the last place left for them
+            log.exception("Failed to save %d ledger entries: %s", len(lines), lines)
+            return
+
+        log.error(
+            "Saved %d unwritten ledger entries to %s",
+            len(lines),
+            self._dead_letter_path,
+        )
+
+    async def _write(self, entries: list[LedgerEntry]) -> None:
+        await self._database.execute(
+            INSERT_ENTRIES_QUERY,
+            {
+                "profiles": [entry.profile for entry in entries],
+                "amounts": [entry.amount for entry in entries],
+                "reasons": [entry.reason for entry in entries],
+                "timestamps": [entry.timestamp for entry in entries],
+            },
+        )
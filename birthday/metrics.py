@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import functools
+import logging
+import math
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+import databases
+from aiohttp import web
+
+__all__ = (
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "MetricsServer",
+    "InstrumentedDatabase",
+    "registry",
+    "track_command",
+)
+
+log = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+Labels = tuple[tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if len(labels) == 0:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    """Gauge which is either set directly or read from a function when scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self._values: dict[Labels, float | Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[_labels(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels: Any) -> None:
+        self._values[_labels(labels)] = function
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, value in list(self._values.items()):
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    log.exception("Failed to read %s%s", self.name, labels)
+                    continue
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, help)
+        self._buckets = (*sorted(buckets), math.inf)
+        # Per label set: cumulative bucket counts, sum and count
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        if (entry := self._values.get(key)) is None:
+            entry = self._values[key] = ([0] * len(self._buckets), [0.0, 0])
+        counts, totals = entry
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                counts[i] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[tuple[str, Labels, float]]:
+        for labels, (counts, (total, count)) in self._values.items():
+            for bound, bucket_count in zip(self._buckets, counts):
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                yield f"{self.name}_bucket", (*labels, ("le", le)), bucket_count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text format
+
+    Metrics are registered by name, so reloaded extensions get back the
+    metrics they registered before.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge, name, help)
+
+    def histogram(
+        self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        if (metric := self._metrics.get(name)) is None:
+            metric = self._metrics[name] = Histogram(name, help, buckets)
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+    def _register(self, cls: type[M], name: str, help: str) -> M:
+        if (metric := self._metrics.get(name)) is None:
+            metric = self._metrics[name] = cls(name, help)
+        assert isinstance(metric, cls)
+        return metric
+
+
+registry = Registry()
+
+command_duration = registry.histogram(
+    "bot_command_duration_seconds", "Duration of application commands"
+)
+query_duration = registry.histogram(
+    "bot_db_query_duration_seconds", "Duration of database queries by call site"
+)
+
+
+def track_command(func: F) -> F:
+    """Record the duration of an application command callback"""
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        status = "error"
+        start = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+            status = "ok"
+            return result
+        finally:
+            command_duration.observe(
+                time.perf_counter() - start, command=func.__name__, status=status
+            )
+
+    return wrapper  # type: ignore[return-value]
+
+
+def _get_call_site() -> str:
+    """Get the innermost bot function outside of the database layer"""
+
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("birthday.") and module != __name__:
+            return f"{module}:{frame.f_code.co_name}"
+        frame = frame.f_back  # type: ignore[assignment]
+    return "unknown"
+
+
+class InstrumentedDatabase(databases.Database):
+    """Database recording the duration of every query by its call site"""
+
+    async def fetch_all(self, *args: Any, **kwargs: Any) -> Any:
+        with query_duration.time(site=_get_call_site()):
+            return await super().fetch_all(*args, **kwargs)
+
+    async def fetch_one(self, *args: Any, **kwargs: Any) -> Any:
+        with query_duration.time(site=_get_call_site()):
+            return await super().fetch_one(*args, **kwargs)
+
+    async def fetch_val(self, *args: Any, **kwargs: Any) -> Any:
+        with query_duration.time(site=_get_call_site()):
+            return await super().fetch_val(*args, **kwargs)
+
+    async def execute(self, *args: Any, **kwargs: Any) -> Any:
+        with query_duration.time(site=_get_call_site()):
+            return await super().execute(*args, **kwargs)
+
+    async def execute_many(self, *args: Any, **kwargs: Any) -> Any:
+        with query_duration.time(site=_get_call_site()):
+            return await super().execute_many(*args, **kwargs)
+
+
+class MetricsServer:
+    """HTTP server exposing the registry at `/metrics`"""
+
+    def __init__(self, registry: Registry, host: str, port: int) -> None:
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        log.info("Serving metrics on %s:%d", self._host, self._port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self._registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
@@ -1,15 +1,135 @@
 from __future__ import annotations
 
 from datetime import datetime
+from typing import Any, NamedTuple
 
-import databases
 import ormar
 import sqlalchemy
 
-from birthday.utils import get_database_url
+from birthday.cache import TTLCache
+from birthday.leaderboard import Leaderboards
+from birthday.ledger import LedgerWriter
+from birthday.metrics import InstrumentedDatabase, registry
+from birthday.partitions import PartitionMaintainer
+from birthday.pool import get_pool_options
+from birthday.repository import Repository
+from birthday.utils import get_database_url, get_env, get_replica_database_url
 
-database = databases.Database(get_database_url())
+database = InstrumentedDatabase(get_database_url(), **get_pool_options())
+# Rankings and history, which can be slightly stale, are read from the replica
+replica = database
+if (replica_url := get_replica_database_url()) is not None:
+    replica = InstrumentedDatabase(replica_url, **get_pool_options())
 metadata = sqlalchemy.MetaData()
+# Hot queries, which bypass ormar and `databases`
+repository = Repository(database, replica)
+
+# Column values of the profiles keyed by (user_id, guild_id), kept up to date by
+# `Profile.update`. Every lookup builds its own instance from them, so changes
+# callers make to a profile don't leak into the cache before they are saved.
+profile_cache: TTLCache[tuple[int, int], dict[str, int]] = TTLCache(
+    ttl=float(get_env("PROFILE_CACHE_TTL", "60")),
+    max_entries=int(get_env("PROFILE_CACHE_MAX_ENTRIES", "10000")),
+)
+registry.gauge("bot_cache_hit_ratio", "Cache hit ratio").set_function(
+    lambda: profile_cache.hit_rate, cache="profiles"
+)
+
+
+# Upsert many profiles in a single round trip
+BULK_ADD_POINTS_QUERY = """
+INSERT INTO profile (user_id, guild_id, points)
+SELECT user_id, :guild_id, amount
+FROM unnest(CAST(:user_ids AS bigint[]), CAST(:amounts AS integer[]))
+    AS changes (user_id, amount)
+ON CONFLICT (guild_id, user_id) DO UPDATE SET points = profile.points + excluded.points
+RETURNING id, user_id, guild_id, points, map_segments
+"""
+
+MAP_SEGMENT_RANKING_COUNT_QUERY = """
+SELECT count(*) FROM profile WHERE guild_id = :guild_id AND map_segments <> 0
+"""
+
+# Record the completion with the next ordinal of the guild, unless it's recorded already
+RECORD_MAP_COMPLETION_QUERY = """
+WITH counter AS (
+    INSERT INTO map_completion_counter (guild_id, completions)
+    SELECT :guild_id, 1
+    WHERE NOT EXISTS (SELECT FROM map_completion WHERE profile = :profile_id)
+    ON CONFLICT (guild_id) DO UPDATE
+    SET completions = map_completion_counter.completions + 1
+    RETURNING completions
+)
+INSERT INTO map_completion (profile, guild_id, ordinal, completed_at)
+SELECT :profile_id, :guild_id, completions, :timestamp FROM counter
+ON CONFLICT (profile) DO NOTHING
+RETURNING ordinal
+"""
+
+MAP_COMPLETION_COUNT_QUERY = """
+SELECT count(*) FROM map_completion WHERE guild_id = :guild_id
+"""
+
+TRANSACTION_HISTORY_QUERY = """
+SELECT id, profile, amount, reason, timestamp FROM "transaction"
+WHERE profile = :profile_id {condition}
+ORDER BY timestamp DESC, id DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# The redundant bound lets the index scan seek past the transaction
+TRANSACTION_HISTORY_AFTER_CONDITION = """
+AND timestamp <= :timestamp
+AND (timestamp < :timestamp OR timestamp = :timestamp AND id < :id)
+"""
+
+TRANSACTION_COUNT_QUERY = """
+SELECT count(*) FROM "transaction" WHERE profile = :profile_id
+"""
+
+UPDATE_MAP_SEGMENTS_QUERY = """
+UPDATE profile SET map_segments = (map_segments | CAST(:add AS integer)) & ~CAST(:remove AS integer)
+WHERE id = :profile_id
+RETURNING map_segments
+"""
+
+LEADERBOARD_QUERY = "SELECT user_id, points FROM profile WHERE guild_id = :guild_id"
+
+
+async def fetch_leaderboard(guild_id: int) -> list[tuple[int, int]]:
+    rows = await database.fetch_all(LEADERBOARD_QUERY, {"guild_id": guild_id})
+    return [(row["user_id"], row["points"]) for row in rows]
+
+
+# Guild leaderboards, kept up to date by every balance change of a `Profile`
+leaderboards = Leaderboards(fetch_leaderboard)
+
+# Transactions of the balance changes, written in batches off the interaction path
+ledger = LedgerWriter(
+    database,
+    flush_interval=float(get_env("LEDGER_FLUSH_INTERVAL", "0.5")),
+    batch_size=int(get_env("LEDGER_BATCH_SIZE", "500")),
+    max_pending=int(get_env("LEDGER_MAX_PENDING", "10000")),
+    dead_letter_path=get_env("LEDGER_DEAD_LETTER_PATH", "ledger-dead-letter.jsonl"),
+)
+
+# Monthly partitions of the `transaction` table, created ahead and archived once
+# they fall out of the retention period
+transaction_partitions = PartitionMaintainer(
+    database,
+    "transaction",
+    interval=float(get_env("TRANSACTION_PARTITION_INTERVAL", "86400")),
+    months_ahead=int(get_env("TRANSACTION_PARTITIONS_AHEAD", "3")),
+    retention_months=int(get_env("TRANSACTION_RETENTION_MONTHS", "0")),
+    archive_schema=get_env("TRANSACTION_ARCHIVE_SCHEMA", "archive"),
+)
+
+
+class MapPurchase(NamedTuple):
+    # Bitmask of the bought segments, 0 if nothing was bought
+    bought: int
+    # Ordinal of the map completion in the guild, if the purchase completed the map
+    completion: int | None
 
 
 class BaseMeta(ormar.ModelMeta):
@@ -22,36 +142,263 @@ class Profile(ormar.Model):
     user_id: int = ormar.BigInteger()
     guild_id: int = ormar.BigInteger()
     points: int = ormar.Integer()
+    # Owned map segments, segment N is stored as bit N - 1
+    map_segments: int = ormar.Integer(default=0, server_default="0", nullable=False)
 
     class Meta(BaseMeta):
         tablename = "profile"
+        constraints = [
+            ormar.UniqueColumns("guild_id", "user_id"),
+            ormar.IndexColumns("guild_id", "points", name="ix_profile_guild_id_points"),
+        ]
+
+    @classmethod
+    async def get_existing(cls, user_id: int, guild_id: int) -> Profile | None:
+        """Get the profile of the user, without creating it if it doesn't exist"""
+
+        if (values := profile_cache.get((user_id, guild_id))) is not None:
+            return cls(**values)
+
+        row = await repository.get_profile(user_id, guild_id)
+        if row is None:
+            return None
+
+        profile = cls(**row)
+        profile.cache()
+        return profile
 
     @classmethod
     async def get_for(cls, user_id: int, guild_id: int) -> Profile:
-        defaults = {"points": 0}
-        profile, _ = await cls.objects.get_or_create(
-            defaults, user_id=user_id, guild_id=guild_id
-        )
+        if (profile := await cls.get_existing(user_id, guild_id)) is not None:
+            return profile
+
+        row = await repository.create_profile(user_id, guild_id)
+        if row is None:
+            # Someone else created the profile in the meantime
+            profile = await cls.objects.get(user_id=user_id, guild_id=guild_id)
+        else:
+            profile = cls(**row)
+            leaderboards.update(guild_id, user_id, profile.points)
+
+        profile.cache()
         return profile
 
+    async def update(self, _columns: list[str] | None = None, **kwargs: Any) -> Profile:
+        try:
+            await super().update(_columns or [], **kwargs)
+        except Exception:
+            # The cached profile may hold changes which never reached the database
+            profile_cache.invalidate(self.cache_key)
+            raise
 
-class MapSegment(ormar.Model):
-    id: int = ormar.Integer(primary_key=True)
-    profile: Profile = ormar.ForeignKey(Profile, nullable=False)
-    number = ormar.Integer(minimum=1, maximum=30)
+        self.cache()
+        leaderboards.update(self.guild_id, self.user_id, self.points)
+        return self
 
-    class Meta(BaseMeta):
-        tablename = "map_segment"
-        constraints = [ormar.UniqueColumns("profile", "number")]
+    async def add_points(
+        self, amount: int, reason: str, *, min_balance: int | None = None
+    ) -> bool:
+        """
+        Atomically add points to the profile and queue its transaction
+
+        If the balance would drop below `min_balance`, nothing is changed and
+        `False` is returned.
+        """
+
+        timestamp = datetime.utcnow()
+        # The ledger must have room for the transaction before the balance changes
+        async with ledger.reserve():
+            points = await repository.add_points(self.id, amount, min_balance)
+            if points is None:
+                return False
+            await ledger.record(self.id, amount, reason, timestamp)
+
+        self.points = points
+        self.cache()
+        leaderboards.update(self.guild_id, self.user_id, self.points)
+        return True
+
+    async def buy_random_map_segments(
+        self, segments: int, cost: int, reason: str, *, limit: int | None = None
+    ) -> MapPurchase:
+        """
+        Buy random map segments the profile doesn't have yet, in a single round
+        trip
+
+        Up to `limit` segments out of the `segments` segments of the map are
+        bought, as many as the profile can afford. The profile is charged `cost`
+        for each one, and the purchase is written as a single transaction. If
+        the map is complete afterwards, its completion is recorded. The profile
+        is updated with its current state even if nothing was bought.
+        """
+
+        timestamp = datetime.utcnow()
+        row = await repository.buy_random_map_segments(
+            self.id, segments, cost, limit, reason, timestamp
+        )
+
+        self.points = row["points"]
+        self.map_segments = row["map_segments"]
+        self.cache()
+        leaderboards.update(self.guild_id, self.user_id, self.points)
+        return MapPurchase(row["bought"], row["completion"])
+
+    async def update_map_segments(self, *, add: int = 0, remove: int = 0) -> None:
+        """Atomically add and remove the map segments in the bitmasks"""
+
+        self.map_segments = await database.fetch_val(
+            UPDATE_MAP_SEGMENTS_QUERY,
+            {"profile_id": self.id, "add": add, "remove": remove},
+        )
+        self.cache()
+
+    @classmethod
+    async def bulk_add_points(
+        cls, guild_id: int, amounts: dict[int, int], reason: str
+    ) -> list[Profile]:
+        """
+        Add points to many users at once and queue their transactions
+
+        `amounts` maps user IDs to the amount of points to add. Missing profiles
+        are created.
+        """
+
+        if len(amounts) == 0:
+            return []
+
+        timestamp = datetime.utcnow()
+        async with ledger.reserve(len(amounts)):
+            rows = await database.fetch_all(
+                BULK_ADD_POINTS_QUERY,
+                {
+                    "guild_id": guild_id,
+                    "user_ids": list(amounts.keys()),
+                    "amounts": list(amounts.values()),
+                },
+            )
+            for row in rows:
+                await ledger.record(
+                    row["id"], amounts[row["user_id"]], reason, timestamp
+                )
+
+        profiles = []
+        for row in rows:
+            profile = cls(**row)
+            profile.cache()
+            leaderboards.update(guild_id, profile.user_id, profile.points)
+            profiles.append(profile)
+
+        return profiles
+
+    @classmethod
+    async def get_map_segment_ranking(
+        cls,
+        guild_id: int,
+        *,
+        after: tuple[int, int] | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[tuple[int, int]]:
+        """
+        Get (user ID, segment count) pairs of the guild, most segments first
+
+        If `after` is given, the ranking starts after that pair.
+        """
+
+        rows = await repository.get_map_segment_ranking(guild_id, after, offset, limit)
+        return [(row["user_id"], row["segments"]) for row in rows]
+
+    @classmethod
+    async def count_map_segment_ranking(cls, guild_id: int) -> int:
+        return await replica.fetch_val(
+            MAP_SEGMENT_RANKING_COUNT_QUERY, {"guild_id": guild_id}
+        )
+
+    @property
+    def cache_key(self) -> tuple[int, int]:
+        return self.user_id, self.guild_id
+
+    def cache(self) -> None:
+        """Cache a copy of the column values of the profile"""
+
+        profile_cache.put(
+            self.cache_key,
+            {
+                "id": self.id,
+                "user_id": self.user_id,
+                "guild_id": self.guild_id,
+                "points": self.points,
+                "map_segments": self.map_segments,
+            },
+        )
 
 
 class MapCompletion(ormar.Model):
     id: int = ormar.Integer(primary_key=True)
     profile: Profile = ormar.ForeignKey(Profile, nullable=False, unique=True)
+    guild_id: int = ormar.BigInteger()
+    # 1-based position of the completion in the guild, from `MapCompletionCounter`
+    ordinal: int = ormar.Integer()
     completed_at: datetime = ormar.DateTime(default=datetime.utcnow)
 
     class Meta(BaseMeta):
         tablename = "map_completion"
+        constraints = [ormar.UniqueColumns("guild_id", "ordinal")]
+
+    @classmethod
+    async def record(cls, profile: Profile) -> int | None:
+        """
+        Record the completion of the map of the profile
+
+        Returns the ordinal of the completion in the guild, or `None` if the
+        profile has completed the map before.
+        """
+
+        return await database.fetch_val(
+            RECORD_MAP_COMPLETION_QUERY,
+            {
+                "profile_id": profile.id,
+                "guild_id": profile.guild_id,
+                "timestamp": datetime.utcnow(),
+            },
+        )
+
+    @classmethod
+    async def get_ranking(
+        cls,
+        guild_id: int,
+        *,
+        after: int | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[tuple[int, int, datetime]]:
+        """
+        Get (ordinal, user ID, completion time) of the completions of the guild,
+        in order
+
+        If `after` is an ordinal, the ranking starts after that completion.
+        """
+
+        rows = await repository.get_map_completion_ranking(
+            guild_id, after, offset, limit
+        )
+        return [(row["ordinal"], row["user_id"], row["completed_at"]) for row in rows]
+
+    @classmethod
+    async def count_ranking(cls, guild_id: int) -> int:
+        return await replica.fetch_val(
+            MAP_COMPLETION_COUNT_QUERY, {"guild_id": guild_id}
+        )
+
+
+class MapCompletionCounter(ormar.Model):
+    """Number of map completions recorded in the guild so far"""
+
+    guild_id: int = ormar.BigInteger(primary_key=True, autoincrement=False)
+    completions: int = ormar.Integer(default=0, server_default="0", nullable=False)
+
+    class Meta(BaseMeta):
+        tablename = "map_completion_counter"
 
 
 class Transaction(ormar.Model):
@@ -59,7 +406,50 @@ class Transaction(ormar.Model):
     profile: Profile = ormar.ForeignKey(Profile, nullable=False)
     amount: int = ormar.Integer()
     reason: str = ormar.String(max_length=255)
-    timestamp: datetime = ormar.DateTime(default=datetime.utcnow)
+    # Partition key of the table, whose primary key is (id, timestamp)
+    timestamp: datetime = ormar.DateTime(default=datetime.utcnow, nullable=False)
 
     class Meta(BaseMeta):
         tablename = "transaction"
+        constraints = [
+            ormar.IndexColumns(
+                "profile", "timestamp", "id", name="ix_transaction_profile_timestamp_id"
+            )
+        ]
+
+    @classmethod
+    async def get_history(
+        cls,
+        profile_id: int,
+        *,
+        after: tuple[datetime, int] | None = None,
+        offset: int = 0,
+        limit: int | None = None,
+    ) -> list[Transaction]:
+        """
+        Get the transactions of the profile, newest first
+
+        If `after` is a (timestamp, transaction ID) pair, the history starts
+        after that transaction.
+        """
+
+        values: dict[str, Any] = {
+            "profile_id": profile_id,
+            "limit": limit,
+            "offset": offset,
+        }
+        condition = ""
+        if after is not None:
+            values["timestamp"], values["id"] = after
+            condition = TRANSACTION_HISTORY_AFTER_CONDITION
+
+        rows = await replica.fetch_all(
+            TRANSACTION_HISTORY_QUERY.format(condition=condition), values
+        )
+        return [cls(**row) for row in rows]
+
+    @classmethod
+    async def count_history(cls, profile_id: int) -> int:
+        return await replica.fetch_val(
+            TRANSACTION_COUNT_QUERY, {"profile_id": profile_id}
+        )
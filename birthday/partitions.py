@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+from contextlib import suppress
+from datetime import date, datetime
+
+import databases
+
+__all__ = (
+    "PartitionMaintainer",
+    "add_months",
+    "get_partition_name",
+    "is_partition_name",
+    "maintain_partitions",
+)
+
+log = logging.getLogger(__name__)
+
+# Monthly partitions of the table are named `<table>_YYYY_MM`
+PARTITION_NAME = re.compile(r"(?P<table>\w+)_(?P<year>\d{4})_(?P<month>\d{2})")
+
+PARTITIONS_QUERY = """
+SELECT child.relname AS name
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+WHERE parent.relname = :table AND pg_namespace.nspname = current_schema()
+ORDER BY child.relname
+"""
+
+CREATE_PARTITION_QUERY = """
+CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}"
+FOR VALUES FROM ('{start}') TO ('{end}')
+"""
+
+DETACH_PARTITION_QUERY = 'ALTER TABLE "{table}" DETACH PARTITION "{name}"'
+
+CREATE_SCHEMA_QUERY = 'CREATE SCHEMA IF NOT EXISTS "{schema}"'
+
+ARCHIVE_PARTITION_QUERY = 'ALTER TABLE "{name}" SET SCHEMA "{schema}"'
+
+
+def add_months(month: date, months: int) -> date:
+    """Get the first day of the month `months` after the month of the date"""
+
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_name(table: str, month: date) -> str:
+    return f"{table}_{month.year:04d}_{month.month:02d}"
+
+
+def is_partition_name(table: str, name: str) -> bool:
+    match = PARTITION_NAME.fullmatch(name)
+    return match is not None and match["table"] == table
+
+
+async def maintain_partitions(
+    database: databases.Database,
+    table: str,
+    *,
+    months_ahead: int,
+    retention_months: int = 0,
+    archive_schema: str = "archive",
+    today: date | None = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Create the monthly partitions of the table up to `months_ahead` months
+    after the current one, and move the partitions which ended more than
+    `retention_months` months ago to the archive schema
+
+    Archived partitions are detached, so they are no longer scanned, but
+    stay queryable as `<archive_schema>.<table>_YYYY_MM`. A retention of 0
+    keeps every partition attached. Returns the names of the created and
+    archived partitions.
+    """
+
+    current = add_months(today or datetime.utcnow().date(), 0)
+    rows = await database.fetch_all(PARTITIONS_QUERY, {"table": table})
+    existing = {row["name"] for row in rows}
+
+    created = []
+    for months in range(months_ahead + 1):
+        start = add_months(current, months)
+        name = get_partition_name(table, start)
+        if name in existing:
+            continue
+
+        await database.execute(
+            CREATE_PARTITION_QUERY.format(
+                name=name, table=table, start=start, end=add_months(start, 1)
+            )
+        )
+        created.append(name)
+
+    archived: list[str] = []
+    if retention_months <= 0:
+        return created, archived
+
+    oldest = add_months(current, -retention_months)
+    expired = [
+        name
+        for name in sorted(existing)
+        if is_partition_name(table, name) and name < get_partition_name(table, oldest)
+    ]
+    if len(expired) > 0:
+        await database.execute(CREATE_SCHEMA_QUERY.format(schema=archive_schema))
+    for name in expired:
+        async with database.transaction():
+            await database.execute(
+                DETACH_PARTITION_QUERY.format(table=table, name=name)
+            )
+            await database.execute(
+                ARCHIVE_PARTITION_QUERY.format(name=name, schema=archive_schema)
+            )
+        archived.append(name)
+
+    return created, archived
+
+
+class PartitionMaintainer:
+    """
+    Background task running `maintain_partitions` when started and then
+    every `interval` seconds
+    """
+
+    def __init__(
+        self,
+        database: databases.Database,
+        table: str,
+        *,
+        interval: float,
+        months_ahead: int,
+        retention_months: int,
+        archive_schema: str,
+    ) -> None:
+        self._database = database
+        self._table = table
+        self._interval = interval
+        self._months_ahead = months_ahead
+        self._retention_months = retention_months
+        self._archive_schema = archive_schema
+        self._task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            # Make sure the current month has a partition before anything is written
+            await self.run()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def run(self) -> tuple[list[str], list[str]]:
+        created, archived = await maintain_partitions(
+            self._database,
+            self._table,
+            months_ahead=self._months_ahead,
+            retention_months=self._retention_months,
+            archive_schema=self._archive_schema,
+        )
+        if len(created) > 0:
+            log.info("Created %s partitions: %s", self._table, ", ".join(created))
+        if len(archived) > 0:
+            log.info("Archived %s partitions: %s", self._table, ", ".join(archived))
+        return created, archived
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.run()
+            except Exception:
+                log.exception("Failed to maintain %s partitions", self._table)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import asyncpg
+import databases
+
+from birthday.utils import get_env
+
+__all__ = ("PoolStats", "InstrumentedPool", "get_pool_options", "instrument_pool")
+
+
+def get_pool_options() -> dict[str, Any]:
+    """Get the asyncpg pool options configured by the environment"""
+
+    options: dict[str, Any] = {
+        "min_size": int(get_env("DATABASE_POOL_MIN_SIZE", "10")),
+        "max_size": int(get_env("DATABASE_POOL_MAX_SIZE", "10")),
+    }
+    # In milliseconds, 0 disables the timeout
+    statement_timeout = get_env("DATABASE_STATEMENT_TIMEOUT", "0")
+    if statement_timeout != "0":
+        options["server_settings"] = {"statement_timeout": statement_timeout}
+
+    return options
+
+
+@dataclass
+class PoolStats:
+    size: int
+    idle: int
+    max_size: int
+    in_use: int
+    waiting: int
+    acquisitions: int
+    timeouts: int
+    # Acquisitions which found every connection in use
+    queued: int
+    wait_time: float
+    max_wait_time: float
+    queued_wait_time: float
+
+    @property
+    def average_wait_time(self) -> float:
+        return self.wait_time / self.acquisitions if self.acquisitions else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.in_use}/{self.max_size} connections in use "
+            f"({self.size} open, {self.idle} idle), {self.waiting} waiting\n"
+            f"{self.acquisitions} acquisitions, {self.timeouts} timeouts, "
+            f"{self.queued} queued\n"
+            f"Acquire wait: {self.average_wait_time * 1000:.2f}ms average, "
+            f"{self.max_wait_time * 1000:.2f}ms max, "
+            f"{self.wait_time:.3f}s total, {self.queued_wait_time:.3f}s in queue"
+        )
+
+
+class InstrumentedPool:
+    """asyncpg pool proxy counting connection acquisitions and their wait times"""
+
+    def __init__(self, pool: asyncpg.Pool, acquire_timeout: float | None) -> None:
+        self._pool = pool
+        self._acquire_timeout = acquire_timeout
+        self._in_use = 0
+        self._waiting = 0
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._queued = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._queued_wait_time = 0.0
+
+    async def acquire(self) -> asyncpg.Connection:
+        # Every connection is either in use or promised to an earlier caller
+        queued = self._in_use + self._waiting >= self._pool.get_max_size()
+        self._waiting += 1
+        start = time.perf_counter()
+        try:
+            connection = await self._pool.acquire(timeout=self._acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        finally:
+            self._waiting -= 1
+
+        wait_time = time.perf_counter() - start
+        self._acquisitions += 1
+        self._wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        if queued:
+            self._queued += 1
+            self._queued_wait_time += wait_time
+
+        self._in_use += 1
+        return connection
+
+    async def release(self, connection: asyncpg.Connection) -> None:
+        try:
+            await self._pool.release(connection)
+        finally:
+            self._in_use -= 1
+
+    @property
+    def stats(self) -> PoolStats:
+        return PoolStats(
+            size=self._pool.get_size(),
+            idle=self._pool.get_idle_size(),
+            max_size=self._pool.get_max_size(),
+            in_use=self._in_use,
+            waiting=self._waiting,
+            acquisitions=self._acquisitions,
+            timeouts=self._timeouts,
+            queued=self._queued,
+            wait_time=self._wait_time,
+            max_wait_time=self._max_wait_time,
+            queued_wait_time=self._queued_wait_time,
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pool, name)
+
+
+def instrument_pool(database: databases.Database) -> InstrumentedPool:
+    """
+    Wrap the pool of a connected database, so every connection it hands out
+    is counted
+    """
+
+    # `databases` has no public hook for the pool, its Postgres backend
+    # acquires and releases connections through this attribute
+    backend: Any = database._backend
+    timeout = float(get_env("DATABASE_ACQUIRE_TIMEOUT", "30"))
+    pool = InstrumentedPool(backend._pool, timeout if timeout > 0 else None)
+    backend._pool = pool
+    return pool
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any
+
+import asyncpg
+import databases
+
+from birthday.metrics import query_duration
+
+__all__ = ("Repository",)
+
+PROFILE_QUERY = """
+SELECT id, user_id, guild_id, points, map_segments
+FROM profile WHERE user_id = $1 AND guild_id = $2
+"""
+
+# Unlike get_or_create, this can't race with another insert into a duplicate profile
+CREATE_PROFILE_QUERY = """
+INSERT INTO profile (user_id, guild_id, points) VALUES ($1, $2, 0)
+ON CONFLICT (guild_id, user_id) DO NOTHING
+RETURNING id, user_id, guild_id, points, map_segments
+"""
+
+# A single statement for both cases keeps a single prepared statement
+ADD_POINTS_QUERY = """
+UPDATE profile SET points = points + $2
+WHERE id = $1 AND ($3::integer IS NULL OR points + $2 >= $3)
+RETURNING points
+"""
+
+# Buy up to $5 random missing map segments, as many as the profile can afford,
+# write their transaction and record the completion of the map in one statement.
+# The locked row is re-read after concurrent purchases, so they can't double-spend,
+# and the completion gets the next ordinal of the guild from its counter.
+BUY_RANDOM_MAP_SEGMENTS_QUERY = """
+WITH current AS (
+    SELECT id, points, map_segments FROM profile WHERE id = $1 FOR UPDATE
+),
+picked AS (
+    SELECT coalesce(bit_or(1 << (segment - 1)), 0) AS bitmask, count(*) AS segments
+    FROM (
+        SELECT segment
+        FROM current, generate_series(1, $2::integer) AS segment
+        WHERE current.map_segments & (1 << (segment - 1)) = 0
+        ORDER BY random()
+        LIMIT least($5::integer, (SELECT points FROM current) / $4::integer)
+    ) AS missing
+),
+bought AS (
+    UPDATE profile
+    SET points = points - $4::integer * picked.segments,
+        map_segments = map_segments | picked.bitmask
+    FROM picked
+    WHERE profile.id = $1 AND picked.segments > 0
+    RETURNING profile.id, profile.guild_id, profile.points, profile.map_segments,
+        picked.bitmask, picked.segments
+),
+ledger AS (
+    INSERT INTO "transaction" (profile, amount, reason, timestamp)
+    SELECT id, -$4::integer * segments, $6, $7 FROM bought
+),
+counter AS (
+    INSERT INTO map_completion_counter (guild_id, completions)
+    SELECT guild_id, 1 FROM bought
+    WHERE map_segments = $3
+        AND NOT EXISTS (SELECT FROM map_completion WHERE profile = bought.id)
+    ON CONFLICT (guild_id) DO UPDATE
+    SET completions = map_completion_counter.completions + 1
+    RETURNING guild_id, completions
+),
+completion AS (
+    INSERT INTO map_completion (profile, guild_id, ordinal, completed_at)
+    SELECT $1, guild_id, completions, $7 FROM counter
+    ON CONFLICT (profile) DO NOTHING
+    RETURNING ordinal
+)
+SELECT
+    coalesce(bought.points, current.points) AS points,
+    coalesce(bought.map_segments, current.map_segments) AS map_segments,
+    coalesce(bought.bitmask, 0) AS bought,
+    completion.ordinal AS completion
+FROM current
+LEFT JOIN bought ON true
+LEFT JOIN completion ON true
+"""
+
+# Profiles with the most map segments, the order is backed by an expression index.
+# The redundant bound of the second page lets the index scan seek past the pair.
+MAP_SEGMENT_RANKING_QUERY = """
+SELECT user_id, bit_count(map_segments::bit(32)) AS segments
+FROM profile
+WHERE guild_id = $1 AND map_segments <> 0
+ORDER BY bit_count(map_segments::bit(32)) DESC, user_id
+LIMIT $2 OFFSET $3
+"""
+
+MAP_SEGMENT_RANKING_AFTER_QUERY = """
+SELECT user_id, bit_count(map_segments::bit(32)) AS segments
+FROM profile
+WHERE guild_id = $1 AND map_segments <> 0
+    AND bit_count(map_segments::bit(32)) <= $5
+    AND (bit_count(map_segments::bit(32)) < $5
+        OR bit_count(map_segments::bit(32)) = $5 AND user_id > $4)
+ORDER BY bit_count(map_segments::bit(32)) DESC, user_id
+LIMIT $2 OFFSET $3
+"""
+
+MAP_COMPLETION_RANKING_QUERY = """
+SELECT map_completion.ordinal, profile.user_id, map_completion.completed_at
+FROM map_completion JOIN profile ON profile.id = map_completion.profile
+WHERE map_completion.guild_id = $1 AND map_completion.ordinal > $4
+ORDER BY map_completion.ordinal
+LIMIT $2 OFFSET $3
+"""
+
+
+class Repository:
+    """
+    Hot queries run directly on the asyncpg pools behind the databases
+
+    This skips the query compilation and result conversion of `databases`.
+    Every query is a constant, so asyncpg prepares it once per connection and
+    reuses the named prepared statement from its statement cache, with the
+    rows decoded from the binary protocol. Connections are borrowed from the
+    pools of the databases, so they have to be connected, and the queries
+    don't take part in their transactions.
+    """
+
+    def __init__(
+        self, database: databases.Database, replica: databases.Database
+    ) -> None:
+        self._database = database
+        self._replica = replica
+
+    async def get_profile(self, user_id: int, guild_id: int) -> asyncpg.Record | None:
+        return await self._fetchrow(
+            self._database, "get_profile", PROFILE_QUERY, user_id, guild_id
+        )
+
+    async def create_profile(
+        self, user_id: int, guild_id: int
+    ) -> asyncpg.Record | None:
+        """Create an empty profile, or return `None` if it exists already"""
+
+        return await self._fetchrow(
+            self._database, "create_profile", CREATE_PROFILE_QUERY, user_id, guild_id
+        )
+
+    async def add_points(
+        self, profile_id: int, amount: int, min_balance: int | None
+    ) -> int | None:
+        """
+        Add points to the profile and return its new balance, or `None` if the
+        balance would drop below `min_balance`
+        """
+
+        row = await self._fetchrow(
+            self._database,
+            "add_points",
+            ADD_POINTS_QUERY,
+            profile_id,
+            amount,
+            min_balance,
+        )
+        return None if row is None else row["points"]
+
+    async def buy_random_map_segments(
+        self,
+        profile_id: int,
+        segments: int,
+        cost: int,
+        limit: int | None,
+        reason: str,
+        timestamp: datetime,
+    ) -> asyncpg.Record:
+        row = await self._fetchrow(
+            self._database,
+            "buy_random_map_segments",
+            BUY_RANDOM_MAP_SEGMENTS_QUERY,
+            profile_id,
+            segments,
+            (1 << segments) - 1,
+            cost,
+            limit,
+            reason,
+            timestamp,
+        )
+        assert row is not None
+        return row
+
+    async def get_map_segment_ranking(
+        self,
+        guild_id: int,
+        after: tuple[int, int] | None,
+        offset: int,
+        limit: int | None,
+    ) -> list[asyncpg.Record]:
+        if after is None:
+            return await self._fetch(
+                self._replica,
+                "get_map_segment_ranking",
+                MAP_SEGMENT_RANKING_QUERY,
+                guild_id,
+                limit,
+                offset,
+            )
+
+        return await self._fetch(
+            self._replica,
+            "get_map_segment_ranking",
+            MAP_SEGMENT_RANKING_AFTER_QUERY,
+            guild_id,
+            limit,
+            offset,
+            *after,
+        )
+
+    async def get_map_completion_ranking(
+        self, guild_id: int, after: int | None, offset: int, limit: int | None
+    ) -> list[asyncpg.Record]:
+        # Ordinals start at 1
+        return await self._fetch(
+            self._replica,
+            "get_map_completion_ranking",
+            MAP_COMPLETION_RANKING_QUERY,
+            guild_id,
+            limit,
+            offset,
+            after or 0,
+        )
+
+    async def _fetchrow(
+        self, database: databases.Database, name: str, query: str, *args: Any
+    ) -> asyncpg.Record | None:
+        pool = self._get_pool(database)
+        with query_duration.time(site=f"{__name__}:{name}"):
+            connection = await pool.acquire()
+            try:
+                return await connection.fetchrow(query, *args)
+            finally:
+                await pool.release(connection)
+
+    async def _fetch(
+        self, database: databases.Database, name: str, query: str, *args: Any
+    ) -> list[asyncpg.Record]:
+        pool = self._get_pool(database)
+        with query_duration.time(site=f"{__name__}:{name}"):
+            connection = await pool.acquire()
+            try:
+                return await connection.fetch(query, *args)
+            finally:
+                await pool.release(connection)
+
+    @staticmethod
+    def _get_pool(database: databases.Database) -> Any:
+        # The asyncpg pool, or its `InstrumentedPool` proxy, of the Postgres backend
+        pool = getattr(database._backend, "_pool", None)
+        assert pool is not None, "The database is not connected"
+        return pool
@@ -26,6 +26,21 @@ def get_database_url() -> str:
     return f"postgresql://{user}:{password}@{host}:{port}/{database}"
 
 
+def get_replica_database_url() -> str | None:
+    """Get the read replica database url, if a replica is configured"""
+
+    host = get_env("POSTGRES_REPLICA_HOST", "")
+    if host == "":
+        return None
+
+    port = get_env("POSTGRES_REPLICA_PORT", get_env("POSTGRES_PORT", "5432"))
+    user = get_env("POSTGRES_USER")
+    password = get_env("POSTGRES_PASSWORD")
+    database = get_env("POSTGRES_DB")
+
+    return f"postgresql://{user}:{password}@{host}:{port}/{database}"
+
+
 def format_bool(
     value: bool,
     *,
@@ -0,0 +1,65 @@
+import random
+import unittest
+from bisect import bisect_left, insort
+
+from birthday.leaderboard import Leaderboard, SkipList
+
+
+class SkipListTest(unittest.TestCase):
+    def test_matches_sorted_list(self) -> None:
+        rng = random.Random(7)
+        skip_list = SkipList()
+        expected: list[tuple[int, int]] = []
+
+        for _ in range(5000):
+            key = (rng.randrange(-50, 50), rng.randrange(200))
+            if key in expected:
+                skip_list.remove(key)
+                expected.remove(key)
+            else:
+                skip_list.add(key)
+                insort(expected, key)
+
+            probe = (rng.randrange(-50, 50), rng.randrange(200))
+            self.assertEqual(skip_list.index(probe), bisect_left(expected, probe))
+
+            start = rng.randrange(len(expected) + 2)
+            stop = start + rng.randrange(15)
+            self.assertEqual(skip_list.slice(start, stop), expected[start:stop])
+            self.assertEqual(len(skip_list), len(expected))
+
+        self.assertEqual(skip_list.slice(0, len(expected)), expected)
+
+    def test_remove_missing_key(self) -> None:
+        skip_list = SkipList()
+        skip_list.add((1, 1))
+
+        with self.assertRaises(KeyError):
+            skip_list.remove((1, 2))
+        self.assertEqual(len(skip_list), 1)
+
+
+class LeaderboardTest(unittest.TestCase):
+    def test_ranks_by_points_then_user_id(self) -> None:
+        leaderboard = Leaderboard()
+        leaderboard.merge([(1, 10), (2, 30), (3, 10)])
+        leaderboard.update(4, 20)
+        leaderboard.update(2, 5)
+
+        self.assertEqual(leaderboard.top(10), [(4, 20), (1, 10), (3, 10), (2, 5)])
+        self.assertEqual(leaderboard.top(2, 1), [(1, 10), (3, 10)])
+        self.assertEqual(leaderboard.rank(3), 3)
+        self.assertEqual(leaderboard.rank(2), 4)
+        self.assertIsNone(leaderboard.rank(5))
+        self.assertEqual(len(leaderboard), 4)
+
+    def test_merge_keeps_newer_points(self) -> None:
+        leaderboard = Leaderboard()
+        leaderboard.update(1, 50)
+        leaderboard.merge([(1, 10), (2, 20)])
+
+        self.assertEqual(leaderboard.top(10), [(1, 50), (2, 20)])
+
+
+if __name__ == "__main__":
+    unittest.main()
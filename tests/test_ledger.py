@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from typing import Any
+
+import asyncpg
+
+from birthday.ledger import LedgerWriter
+
+TIMESTAMP = datetime(2026, 10, 18, 12, 0)
+
+
+class FakeDatabase:
+    """
+    Keeps the written ledger rows, rejects rows with a "bad" reason and fails
+    every write while it's down
+    """
+
+    def __init__(self) -> None:
+        self.rows: list[tuple[int, int, str]] = []
+        self.down = False
+
+    async def execute(self, query: str, values: dict[str, Any]) -> None:
+        if self.down:
+            raise ConnectionRefusedError("database is down")
+        if "bad" in values["reasons"]:
+            raise asyncpg.StringDataRightTruncationError("value too long")
+
+        self.rows.extend(zip(values["profiles"], values["amounts"], values["reasons"]))
+
+
+class LedgerWriterTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dead_letter_path = os.path.join(directory.name, "dead-letter.jsonl")
+        self.database = FakeDatabase()
+        self.ledger = LedgerWriter(
+            self.database,  # type: ignore[arg-type]
+            flush_interval=3600,
+            batch_size=100,
+            max_pending=3,
+            dead_letter_path=self.dead_letter_path,
+        )
+
+    async def record(self, profile: int, reason: str = "ok") -> None:
+        async with self.ledger.reserve():
+            await self.ledger.record(profile, 10, reason, TIMESTAMP)
+
+    async def flush(self) -> None:
+        await self.ledger._flush()
+
+    def read_dead_letters(self) -> list[dict[str, Any]]:
+        if not os.path.exists(self.dead_letter_path):
+            return []
+        with open(self.dead_letter_path, encoding="utf-8") as file:
+            return [json.loads(line) for line in file]
+
+    async def test_rejected_row_is_dead_lettered(self) -> None:
+        self.ledger.start()
+        await self.record(1)
+        await self.record(2, "bad")
+        await self.record(3)
+        await self.flush()
+
+        self.assertEqual(self.database.rows, [(1, 10, "ok"), (3, 10, "ok")])
+        self.assertEqual(
+            self.read_dead_letters(),
+            [
+                {
+                    "profile": 2,
+                    "amount": 10,
+                    "reason": "bad",
+                    "timestamp": TIMESTAMP.isoformat(),
+                }
+            ],
+        )
+        self.assertEqual(self.ledger.pending, 0)
+
+        # Later entries are written as usual
+        await self.record(4)
+        await self.ledger.close()
+        self.assertEqual(self.database.rows[-1], (4, 10, "ok"))
+
+    async def test_failed_batch_is_retried(self) -> None:
+        self.ledger.start()
+        await self.record(1)
+        self.database.down = True
+        await self.flush()
+
+        self.assertEqual(self.ledger.pending, 1)
+        self.assertEqual(self.read_dead_letters(), [])
+
+        self.database.down = False
+        await self.record(2)
+        await self.ledger.close()
+        self.assertEqual(self.database.rows, [(1, 10, "ok"), (2, 10, "ok")])
+
+    async def test_reserve_waits_for_room_before_the_change(self) -> None:
+        self.ledger.start()
+        self.database.down = True
+        for profile in range(3):
+            await self.record(profile)
+
+        changed = asyncio.Event()
+
+        async def change_balance() -> None:
+            async with self.ledger.reserve():
+                changed.set()
+                await self.ledger.record(3, 10, "ok", TIMESTAMP)
+
+        task = asyncio.create_task(change_balance())
+        await asyncio.sleep(0.01)
+        self.assertFalse(changed.is_set())
+
+        # The next flush makes room
+        self.database.down = False
+        self.ledger._wakeup.set()
+        await asyncio.wait_for(task, 1)
+
+        await self.ledger.close()
+        self.assertEqual([row[0] for row in self.database.rows], [0, 1, 2, 3])
+
+    async def test_close_dead_letters_unwritten_entries(self) -> None:
+        self.ledger.start()
+        await self.record(1)
+        await self.record(2)
+        self.database.down = True
+        await self.ledger.close()
+
+        self.assertEqual(
+            [entry["profile"] for entry in self.read_dead_letters()], [1, 2]
+        )
+        self.assertEqual(self.ledger.pending, 0)
+
+    async def test_writes_immediately_when_not_started(self) -> None:
+        await self.record(1)
+        await self.record(2, "bad")
+
+        self.assertEqual(self.database.rows, [(1, 10, "ok")])
+        self.assertEqual([entry["profile"] for entry in self.read_dead_letters()], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from birthday.extensions.map.cache import MapImageCache
+from birthday.extensions.map.encoder import EncoderMode, MapEncoder
+from birthday.extensions.map.map_image import MapImageGenerator
+from birthday.extensions.map.renderer import MapRenderer
+
+
+class MapRendererUpdateTest(unittest.IsolatedAsyncioTestCase):
+    generator: MapImageGenerator
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.generator = MapImageGenerator()
+
+    def setUp(self) -> None:
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        self.cache = MapImageCache(64 * 1024 * 1024)
+        self.renderer = MapRenderer(
+            self.generator,
+            MapEncoder(mode=EncoderMode.FAST),
+            self.cache,
+            executor,
+            max_canvases=2,
+        )
+        # Renders every map from scratch, to compare the updates against
+        self.reference = MapRenderer(
+            self.generator,
+            MapEncoder(mode=EncoderMode.FAST),
+            MapImageCache(64 * 1024 * 1024),
+            executor,
+        )
+
+    async def assert_update(self, previous: int, bitmask: int) -> None:
+        image = await self.renderer.render_update(previous, bitmask)
+        self.assertEqual(image, await self.reference.render(bitmask))
+        self.assertEqual(self.cache.get(bitmask), image)
+
+    async def test_added_segments_are_pasted(self) -> None:
+        await self.assert_update(0b0, 0b1)
+        await self.assert_update(0b1, 0b111)
+        await self.assert_update(0b111, 0b1111)
+
+    async def test_removed_segments_are_not_shown(self) -> None:
+        await self.assert_update(0b0, 0b11)
+        # The map lost a segment, and the kept canvas of 0b11 still has it
+        await self.assert_update(0b11, 0b10)
+        await self.assert_update(0b10, 0b110)
+
+    async def test_canvases_are_bounded(self) -> None:
+        for segment in range(5):
+            self.cache.clear()
+            await self.assert_update(0, 1 << segment)
+
+        self.assertEqual(len(self.renderer._canvases), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import os
+import unittest
+from itertools import count
+from types import SimpleNamespace
+from typing import Any
+from unittest import mock
+
+from discord import File
+from discord.utils import MISSING
+
+# Models create their database connections on import, nothing connects to them
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
+
+from birthday.cache import TTLCache  # noqa: E402
+from birthday.extensions.map import views  # noqa: E402
+from birthday.models import MapPurchase  # noqa: E402
+
+
+class FakeDiscord:
+    """
+    Messages and their attachments as kept by Discord
+
+    Editing the attachments of a message deletes the attachments it had
+    before, so their URLs stop working.
+    """
+
+    def __init__(self) -> None:
+        self.live_urls: set[str] = set()
+        self._ids = count(1)
+
+    def send(self, files: list[File]) -> "FakeMessage":
+        message = FakeMessage(next(self._ids))
+        message.attachments = [self._upload(message, file) for file in files]
+        return message
+
+    def edit(self, message: "FakeMessage", attachments: list[Any]) -> None:
+        kept = [a for a in attachments if not isinstance(a, File)]
+        for attachment in message.attachments:
+            if attachment not in kept:
+                self.live_urls.discard(attachment.url)
+
+        uploaded = [self._upload(message, a) for a in attachments if a not in kept]
+        message.attachments = kept + uploaded
+
+    def _upload(self, message: "FakeMessage", file: File) -> SimpleNamespace:
+        url = f"https://cdn.test/{message.id}/{next(self._ids)}/{file.filename}"
+        self.live_urls.add(url)
+        return SimpleNamespace(url=url)
+
+
+class FakeMessage:
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.attachments: list[SimpleNamespace] = []
+        self.embed: Any = None
+
+
+class FakeInteraction:
+    def __init__(self, discord: FakeDiscord, user_id: int) -> None:
+        self.user = SimpleNamespace(id=user_id)
+        self.response = mock.AsyncMock()
+        self._discord = discord
+        self.message: FakeMessage | None = None
+
+    async def send(self, embed: Any, files: list[File]) -> FakeMessage:
+        self.message = self._discord.send(files)
+        self.message.embed = embed
+        return self.message
+
+    async def edit_original_response(
+        self, *, embed: Any = MISSING, attachments: Any = MISSING, view: Any = MISSING
+    ) -> FakeMessage:
+        assert self.message is not None
+        if attachments is not MISSING:
+            self._discord.edit(self.message, attachments)
+        if embed is not MISSING:
+            self.message.embed = embed
+        return self.message
+
+
+class FakeRenderer:
+    extension = "png"
+
+    async def render(self, bitmask: int) -> bytes:
+        return bitmask.to_bytes(4, "little")
+
+    async def render_update(self, previous: int, bitmask: int) -> bytes:
+        return await self.render(bitmask)
+
+    def render_inline(self, bitmask: int) -> bytes:
+        return bitmask.to_bytes(4, "little")
+
+
+class BrokenRenderer(FakeRenderer):
+    """A renderer whose executor was shut down"""
+
+    async def render_update(self, previous: int, bitmask: int) -> bytes:
+        raise RuntimeError("cannot schedule new futures after shutdown")
+
+
+class MapImageViewAttachmentTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.discord = FakeDiscord()
+        self.cache: TTLCache[int, str] = TTLCache(ttl=3600, max_entries=100)
+
+    async def show_map(
+        self,
+        user_id: int,
+        segments: int,
+        *,
+        with_view: bool = True,
+        renderer: FakeRenderer | None = None,
+    ) -> views.MapImageView:
+        """Show the map the way the `mapa` command does"""
+
+        itx = FakeInteraction(self.discord, user_id)
+        profile = SimpleNamespace(points=10_000, map_segments=segments)
+        view = views.MapImageView(
+            itx,  # type: ignore[arg-type]
+            "Mapa",
+            profile,  # type: ignore[arg-type]
+            segments,
+            renderer or FakeRenderer(),  # type: ignore[arg-type]
+            self.cache,
+        )
+        embed, files = await view.get_map()
+        message = await itx.send(embed, files)
+        if not with_view:
+            view.remember_attachment(segments, message)  # type: ignore[arg-type]
+        return view
+
+    async def buy(self, view: views.MapImageView, segment: int) -> None:
+        profile: Any = view._profile
+
+        async def buy_random_segments(_: Any, limit: int) -> MapPurchase:
+            profile.map_segments |= segment
+            return MapPurchase(segment, None)
+
+        with mock.patch.object(views, "buy_random_segments", buy_random_segments):
+            await view.on_buy_element.callback(view._target)  # type: ignore
+
+    def assert_cached_urls_live(self) -> None:
+        for key in list(self.cache._entries):
+            url = self.cache.get(key)
+            self.assertIn(url, self.discord.live_urls, f"dead URL cached for {key}")
+
+    async def test_images_of_edited_messages_are_not_cached(self) -> None:
+        view = await self.show_map(1, 0b0)
+        await self.buy(view, 0b1)
+        await self.buy(view, 0b10)
+
+        self.assertEqual(len(self.cache), 0)
+
+        # Another user in the same state gets the image uploaded again
+        other = await self.show_map(2, 0b11)
+        message: Any = other._target.message
+        self.assertEqual(len(message.attachments), 1)
+
+    async def test_images_of_never_edited_messages_are_reused(self) -> None:
+        await self.show_map(2, 0b0, with_view=False)
+        await self.show_map(3, 0b1, with_view=False)
+        # Shows the image uploaded with the first message
+        view = await self.show_map(1, 0b0)
+        message: Any = view._target.message
+        self.assertEqual(message.attachments, [])
+
+        # Shows the image uploaded with the second message
+        await self.buy(view, 0b1)
+
+        self.assertEqual(message.attachments, [])
+        self.assertEqual(message.embed.image.url, self.cache.get(0b1))
+        self.assertEqual(len(self.cache), 2)
+        self.assert_cached_urls_live()
+
+    async def test_bought_segment_is_shown_when_rendering_fails(self) -> None:
+        view = await self.show_map(1, 0b0, renderer=BrokenRenderer())
+
+        with self.assertLogs(views.log, "ERROR"):
+            await self.buy(view, 0b1)
+
+        message: Any = view._target.message
+        self.assertEqual(len(message.attachments), 1)
+        self.assertEqual(message.embed.image.url, "attachment://mapa.png")
+
+
+if __name__ == "__main__":
+    unittest.main()
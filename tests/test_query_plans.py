@@ -0,0 +1,67 @@
+import os
+import unittest
+from typing import Any
+
+import asyncpg
+
+# Models create their database connections on import, the checks are skipped
+# unless they can connect
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
+
+from benchmarks import query_plans  # noqa: E402
+from birthday.utils import get_database_url  # noqa: E402
+
+
+def scan(node_type: str, relation: str, cost: float) -> dict[str, Any]:
+    return {"Node Type": node_type, "Relation Name": relation, "Total Cost": cost}
+
+
+class SeqScansTest(unittest.TestCase):
+    def test_small_partitions_are_ignored(self) -> None:
+        plan = {
+            "Node Type": "Append",
+            "Total Cost": 30.0,
+            "Plans": [
+                scan("Index Scan", "transaction_2026_10", 8.5),
+                scan("Seq Scan", "transaction_2023_08", 1.2),
+                scan("Seq Scan", "transaction_2027_01", 0.0),
+            ],
+        }
+
+        self.assertEqual(query_plans.get_seq_scans(plan, {"transaction_2023_08"}), [])
+        self.assertEqual(
+            query_plans.get_seq_scans(plan, set()), ["transaction_2023_08"]
+        )
+
+    def test_tables_are_checked(self) -> None:
+        plan = scan("Seq Scan", "profile", 1500.0)
+
+        self.assertEqual(query_plans.get_seq_scans(plan, set()), ["profile"])
+
+
+class QueryPlansTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Runs `benchmarks.query_plans` against the database of the environment,
+    skipped when there's no Postgres to connect to
+    """
+
+    async def asyncSetUp(self) -> None:
+        try:
+            connection = await asyncpg.connect(get_database_url(), timeout=5)
+        except (ValueError, OSError, asyncpg.PostgresError) as e:
+            self.skipTest(f"Postgres is not available: {e}")
+        await connection.close()
+
+    async def test_hot_queries_use_indexes(self) -> None:
+        # Smaller tables, e.g. of map completions, are cheaper to scan
+        # sequentially, so only the transactions are cut down
+        failures = await query_plans.run(
+            profiles=100_000, guilds=20, transactions_per_profile=2
+        )
+        self.assertEqual(failures, [], "hot queries with sequential scans")
+
+
+if __name__ == "__main__":
+    unittest.main()